@@ -1,9 +1,12 @@
 import asyncio
 import logging
 import os
+from typing import Optional
 
+import aioredis
 import pytz
 from aiogram import Bot, Dispatcher
+from aiogram.bot.api import TelegramAPIServer
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
 from aiogram.contrib.fsm_storage.redis import RedisStorage2
 from apscheduler.executors.asyncio import AsyncIOExecutor
@@ -11,7 +14,10 @@ from apscheduler.jobstores.redis import RedisJobStore
 # from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-from tgbot.config import load_config
+from tgbot.config import load_config, Config
+from tgbot.db_api.basket.abstract import BasketStorage
+from tgbot.db_api.basket.redis_storage import RedisBasketStorage
+from tgbot.db_api.invalidation import CacheInvalidationBus
 from tgbot.db_api.postgres_db import Database
 from tgbot.filters.admin import AdminFilter
 from tgbot.handlers.admins.admin_add_item import register_admin_add_item
@@ -24,11 +30,20 @@ from tgbot.handlers.inline_mode import register_inline_mode
 from tgbot.handlers.payments.telegram_built_in.telegram_payment import register_telegram_built_in_payments
 from tgbot.handlers.user import register_user
 from tgbot.middlewares.album import AlbumMiddleware
+from tgbot.middlewares.album_collectors import AlbumCollector, RedisAlbumCollector, MemoryAlbumCollector
+from tgbot.middlewares.deduplication import UpdateDeduplicationMiddleware
+from tgbot.middlewares.metrics import UpdateMetricsMiddleware
+from tgbot.middlewares.rate_limiters import RateLimiter, RedisRateLimiter, MemoryRateLimiter
 from tgbot.middlewares.telegraph import IntegrationMiddleware
 from tgbot.middlewares.throttling import ThrottlingMiddleware
 from tgbot.misc.allowed_updates import get_handled_updates_list
+from tgbot.misc.job_context import register_job_context, unregister_job_context, DB_JOB_CONTEXT
+from tgbot.misc.metrics import BotMetrics, instrument_bot, instrument_database, start_metrics_server
 from tgbot.misc.on_startup import notify_admin
+from tgbot.misc.schedule import schedule_basket_sweeper, remove_clear_basket_jobs
 from tgbot.misc.set_bot_commands import set_bot_commands
+from tgbot.misc.webhook import run_webhook
+from tgbot.misc.workers import LeaderLock, get_worker_id
 from tgbot.services.integrations.telegraph.abstract import FileUploader
 from tgbot.services.integrations.telegraph.service import TelegraphService
 
@@ -37,9 +52,14 @@ logger = logging.getLogger(__name__)
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
 
-def register_all_middlewares(dp):
-    dp.setup_middleware(ThrottlingMiddleware())
-    dp.setup_middleware(AlbumMiddleware())
+def register_all_middlewares(dp, album_collector: AlbumCollector, rate_limiter: RateLimiter,
+                             metrics: Optional[BotMetrics]):
+    dp.setup_middleware(ThrottlingMiddleware(rate_limiter))
+    album_middleware = AlbumMiddleware(album_collector)
+    dp.bot['album_metrics'] = album_middleware.metrics
+    dp.setup_middleware(album_middleware)
+    if metrics:
+        dp.setup_middleware(UpdateMetricsMiddleware(metrics))
 
 
 async def close_session_file_uploader(dp: Dispatcher, cur_logger: logging.Logger):
@@ -48,6 +68,23 @@ async def close_session_file_uploader(dp: Dispatcher, cur_logger: logging.Logger
     cur_logger.info('FileUploader session has been closed')
 
 
+def create_basket_storage(config: Config, db: Database) -> Optional[BasketStorage]:
+    if config.db.basket_storage == 'redis':
+        redis = aioredis.Redis(host=config.redis.redis_host, port=config.redis.redis_port,
+                               db=config.redis.redis_db_basket, decode_responses=True)
+        return RedisBasketStorage(db, redis, ttl=config.db.basket_ttl)
+    # по умолчанию корзины хранятся в Postgres
+    return
+
+
+def create_shared_redis(config: Config) -> Optional[aioredis.Redis]:
+    # общее состояние процессов: ограничение частоты запросов, а при нескольких процессах и остальное
+    if config.tg_bot.use_redis or config.tg_bot.multi_worker:
+        return aioredis.Redis(host=config.redis.redis_host, port=config.redis.redis_port,
+                              db=config.redis.redis_db_workers, decode_responses=True)
+    return
+
+
 def register_all_filters(dp):
     dp.filters_factory.bind(AdminFilter)
 
@@ -72,13 +109,21 @@ async def main():
     )
     logger.info("Starting bot")
     config = load_config(database_url=DATABASE_URL, path=".env")
+    if config.tg_bot.multi_worker and not config.webhook.use_webhook:
+        # getUpdates отдает обновления только одному клиенту
+        raise RuntimeError('MULTI_WORKER requires USE_WEBHOOK')
 
-    if config.tg_bot.use_redis:
+    # при нескольких процессах состояния пользователей хранятся только в Redis
+    if config.tg_bot.use_redis or config.tg_bot.multi_worker:
         storage = RedisStorage2(host=config.redis.redis_host, port=config.redis.redis_port)
     else:
         storage = MemoryStorage()
 
-    bot = Bot(token=config.tg_bot.token, parse_mode='HTML')
+    if config.tg_bot.api_server:
+        bot = Bot(token=config.tg_bot.token, parse_mode='HTML',
+                  server=TelegramAPIServer.from_base(config.tg_bot.api_server))
+    else:
+        bot = Bot(token=config.tg_bot.token, parse_mode='HTML')
     dp = Dispatcher(bot, storage=storage)
     # jobstores = {
     #     'default': SQLAlchemyJobStore(url=config.db.url)
@@ -95,7 +140,27 @@ async def main():
                                  job_defaults=job_defaults,
                                  timezone=pytz.timezone('Europe/Moscow'))
 
-    db = Database(url=config.db.url)
+    db = Database(url=config.db.url,
+                  min_size=config.db.pool_min_size,
+                  max_size=config.db.pool_max_size,
+                  max_inactive_connection_lifetime=config.db.max_inactive_connection_lifetime,
+                  statement_cache_size=config.db.statement_cache_size,
+                  command_timeout=config.db.command_timeout)
+    basket_storage = create_basket_storage(config, db)
+    if basket_storage:
+        db.basket_storage = basket_storage
+
+    shared_redis = create_shared_redis(config)
+    workers_redis = shared_redis if config.tg_bot.multi_worker else None
+    leader_lock = LeaderLock(workers_redis, get_worker_id()) if workers_redis else None
+    cache_invalidation = CacheInvalidationBus(workers_redis, get_worker_id()) if workers_redis else None
+    leader_task: Optional[asyncio.Task] = None
+
+    metrics = BotMetrics() if config.metrics.enabled else None
+    metrics_runner = None
+    if metrics:
+        instrument_database(db, metrics)
+        instrument_bot(bot, metrics)
 
     file_uploader = TelegraphService()
 
@@ -104,33 +169,75 @@ async def main():
     bot['db'] = db
     bot['file_uploader'] = file_uploader
 
+    if workers_redis:
+        dp.setup_middleware(UpdateDeduplicationMiddleware(workers_redis))
     dp.setup_middleware(IntegrationMiddleware(file_uploader))
-    register_all_middlewares(dp)
+    # сообщения одного альбома могут прийти в разные процессы
+    register_all_middlewares(dp,
+                             RedisAlbumCollector(workers_redis) if workers_redis else MemoryAlbumCollector(),
+                             RedisRateLimiter(shared_redis) if shared_redis else MemoryRateLimiter(),
+                             metrics)
     register_all_filters(dp)
     register_all_handlers(dp)
 
     # start
     try:
+        if metrics:
+            metrics_runner = await start_metrics_server(metrics, config.metrics.host, config.metrics.port)
+            logger.info('Metrics are served on %s:%s/metrics', config.metrics.host, config.metrics.port)
         await db.connect_to_database()
         logger.info('Database connection has been completed')
-        await set_bot_commands(dp)
-        logger.info('Bot commands have setted')
-        # await db.drop_table('users')
-        await db.create_table_users()
-        logger.info('Table "users" have been created')
-        # await db.drop_table('basket')
-        # await db.drop_table('items')
-        await db.create_table_items()
-        # await db.del_all_items_from_table('items')
-        logger.info('Table "items" have been created')
-        await db.create_table_basket()
-        logger.info('Table "basket" have been created')
-        scheduler.start()
-        await notify_admin(bot, config)
-        await dp.start_polling(dp, allowed_updates=get_handled_updates_list(dp))
+        # без нескольких процессов бот всегда ведущий
+        is_leader = await leader_lock.acquire() if leader_lock else True
+        if is_leader:
+            await set_bot_commands(dp)
+            logger.info('Bot commands have setted')
+        # миграции применяются под advisory lock, остальные процессы дожидаются их
+        await db.migrate()
+        logger.info('Database migrations have been applied')
+        if is_leader:
+            await db.check_indexes_usage()
+        if cache_invalidation:
+            cache_invalidation.start(db)
+        await db.get_catalog()
+        logger.info('Catalog has been loaded')
+        # задачи планировщика работают через пул соединений бота
+        register_job_context(DB_JOB_CONTEXT, db)
+        # задачи из общего хранилища выполняет только ведущий процесс
+        scheduler.start(paused=not is_leader)
+        if is_leader:
+            remove_clear_basket_jobs(scheduler)
+            schedule_basket_sweeper(scheduler, db, config)
+            await notify_admin(bot, config)
+        if leader_lock:
+            def on_elected():
+                scheduler.resume()
+                schedule_basket_sweeper(scheduler, db, config)
+
+            leader_task = asyncio.create_task(leader_lock.keep(on_elected=on_elected, on_dismissed=scheduler.pause))
+            logger.info('Worker %s has started as %s', leader_lock.worker_id,
+                        'the leader' if is_leader else 'a follower')
+        if config.webhook.use_webhook:
+            await run_webhook(dp, config.webhook, set_webhook=is_leader)
+        else:
+            # если раньше был установлен вебхук, getUpdates не будет работать
+            await bot.delete_webhook()
+            await dp.start_polling(dp, allowed_updates=get_handled_updates_list(dp))
     finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        if leader_task:
+            leader_task.cancel()
+            await asyncio.gather(leader_task, return_exceptions=True)
+            await leader_lock.release()
+        if cache_invalidation:
+            await cache_invalidation.close()
+        if shared_redis:
+            await shared_redis.close()
         scheduler.shutdown()
+        unregister_job_context(DB_JOB_CONTEXT)
         await db.pool.close()
+        await db.basket_storage.close()
         await close_session_file_uploader(dp, logger)
         await dp.storage.close()
         await dp.storage.wait_closed()
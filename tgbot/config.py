@@ -7,6 +7,15 @@ from environs import Env
 @dataclass
 class DbConfig:
     url: str
+    pool_min_size: int = 10
+    pool_max_size: int = 10
+    max_inactive_connection_lifetime: float = 300.0
+    statement_cache_size: int = 100
+    command_timeout: Optional[float] = None
+    # postgres или redis
+    basket_storage: str = 'postgres'
+    basket_ttl: int = 24 * 60 * 60
+    basket_sweep_interval: int = 10 * 60
 
 
 @dataclass
@@ -14,6 +23,10 @@ class RedisConfig:
     redis_host: str
     redis_port: int
     redis_db_jobstore: int
+    redis_db_basket: int = 2
+    # ограничение частоты запросов; блокировка ведущего процесса, повторы обновлений и сброс кэшей
+    # при нескольких процессах
+    redis_db_workers: int = 3
 
 
 @dataclass
@@ -22,6 +35,41 @@ class TgBot:
     admin_ids: list[int]
     bot_name: str
     use_redis: bool
+    # адрес другого сервера Bot API, например, локального для нагрузочных тестов
+    api_server: Optional[str] = None
+    # несколько процессов бота за одним вебхуком
+    multi_worker: bool = False
+
+
+@dataclass
+class WebhookConfig:
+    use_webhook: bool = False
+    # внешний адрес бота, например, https://example.com
+    webhook_host: Optional[str] = None
+    webhook_path: str = '/webhook'
+    # добавляется к пути, чтобы обновления мог присылать только Telegram
+    webhook_secret: Optional[str] = None
+    webapp_host: str = '0.0.0.0'
+    webapp_port: int = 8080
+    # несколько процессов на одной машине слушают один порт
+    reuse_port: bool = False
+
+    @property
+    def route_path(self) -> str:
+        path = '/' + self.webhook_path.strip('/')
+        return f'{path}/{self.webhook_secret}' if self.webhook_secret else path
+
+    @property
+    def url(self) -> str:
+        return self.webhook_host.rstrip('/') + self.route_path
+
+
+@dataclass
+class MetricsConfig:
+    enabled: bool = False
+    # /metrics для Prometheus; при нескольких процессах на одной машине у каждого свой порт
+    host: str = '127.0.0.1'
+    port: int = 9100
 
 
 @dataclass
@@ -36,6 +84,8 @@ class Config:
     tg_bot: TgBot
     db: DbConfig
     redis: RedisConfig
+    webhook: WebhookConfig
+    metrics: MetricsConfig
     misc: Miscellaneous
 
 
@@ -50,18 +100,52 @@ def load_config(database_url: Optional[str], path: str = None):
         db_port = env.str("DB_PORT")
         db_name = env.str("DB_NAME")
         database_url = f'postgresql://{db_user}:{db_pass}@{db_host}:{db_port}/{db_name}'
+
+    use_webhook = env.bool("USE_WEBHOOK", default=False)
+    webhook_host = env.str("WEBHOOK_HOST", default=None)
+    if use_webhook and not webhook_host:
+        # без адреса бот упадет только при установке вебхука, уже подключившись к базе
+        raise ValueError('WEBHOOK_HOST is required when USE_WEBHOOK is true, e.g. https://example.com')
     return Config(
         tg_bot=TgBot(
             token=env.str("BOT_TOKEN"),
             admin_ids=list(map(int, env.list("ADMINS"))),
             bot_name=env.str("BOT_NAME"),
             use_redis=env.bool("USE_REDIS"),
+            api_server=env.str("BOT_API_SERVER", default=None),
+            multi_worker=env.bool("MULTI_WORKER", default=False)
+        ),
+        db=DbConfig(
+            url=database_url,
+            pool_min_size=env.int("DB_POOL_MIN_SIZE", default=10),
+            pool_max_size=env.int("DB_POOL_MAX_SIZE", default=10),
+            max_inactive_connection_lifetime=env.float("DB_MAX_INACTIVE_CONNECTION_LIFETIME", default=300.0),
+            statement_cache_size=env.int("DB_STATEMENT_CACHE_SIZE", default=100),
+            command_timeout=env.float("DB_COMMAND_TIMEOUT", default=None),
+            basket_storage=env.str("BASKET_STORAGE", default='postgres'),
+            basket_ttl=env.int("BASKET_TTL", default=24 * 60 * 60),
+            basket_sweep_interval=env.int("BASKET_SWEEP_INTERVAL", default=10 * 60)
         ),
-        db=DbConfig(url=database_url),
         redis=RedisConfig(
             redis_host=env.str("REDIS_HOST", default="localhost"),
             redis_port=env.int("REDIS_PORT", default=6379),
-            redis_db_jobstore=env.int("REDIS_DB_JOBESTORE", default=1)
+            redis_db_jobstore=env.int("REDIS_DB_JOBESTORE", default=1),
+            redis_db_basket=env.int("REDIS_DB_BASKET", default=2),
+            redis_db_workers=env.int("REDIS_DB_WORKERS", default=3)
+        ),
+        webhook=WebhookConfig(
+            use_webhook=use_webhook,
+            webhook_host=webhook_host,
+            webhook_path=env.str("WEBHOOK_PATH", default='/webhook'),
+            webhook_secret=env.str("WEBHOOK_SECRET", default=None),
+            webapp_host=env.str("WEBAPP_HOST", default='0.0.0.0'),
+            webapp_port=env.int("WEBAPP_PORT", default=env.int("PORT", default=8080)),
+            reuse_port=env.bool("WEBAPP_REUSE_PORT", default=False)
+        ),
+        metrics=MetricsConfig(
+            enabled=env.bool("METRICS_ENABLED", default=False),
+            host=env.str("METRICS_HOST", default='127.0.0.1'),
+            port=env.int("METRICS_PORT", default=9100)
         ),
         misc=Miscellaneous(
             provider_token_sber=env.str('PROVIDER_TOKEN_SBER')
@@ -0,0 +1,57 @@
+import abc
+import datetime
+import typing
+
+# строка корзины: full_name, item_id, item_name, quantity, item_price, added_at
+BasketLine = typing.Mapping[str, typing.Any]
+
+
+class BasketStorage(abc.ABC):
+    """
+    Where the baskets are kept. Database calls it from its basket methods, so the handlers do not depend on it.
+    """
+
+    # корзина удаляется самим хранилищем по истечении срока, задача в планировщике не нужна
+    expires_by_itself: bool = False
+
+    async def select_items(self, telegram_id: int) -> typing.List[BasketLine]:
+        raise NotImplementedError
+
+    async def count_items(self, telegram_id: int) -> int:
+        raise NotImplementedError
+
+    async def add_item(self, telegram_id: int, item_id: int, quantity: int, added_at: datetime.datetime,
+                       max_lines: int, max_payload_length: int) -> typing.Optional[BasketLine]:
+        """
+        Adds the item or increases its quantity if the basket limits and the stock allow it.
+        Returns None if there is no such item. Otherwise, besides the basket line, the result has
+        item_total_quantity, quantity_in_basket (before adding) and basket_is_full;
+        quantity and added_at are None if the item has not been added.
+        """
+        raise NotImplementedError
+
+    async def reconcile(self, telegram_id: int, changed_at: datetime.datetime) -> typing.List[BasketLine]:
+        """
+        Checks the basket against the stock: unavailable goods are deleted from the basket and quantities greater than
+        the stock are reduced to it. Returns all the lines as they were before checking with the flags "deleted"
+        and "updated"; updated lines have the new quantity.
+        """
+        raise NotImplementedError
+
+    async def delete_item(self, telegram_id: int, item_id: int) -> bool:
+        """Returns False if there was no such item in the basket"""
+        raise NotImplementedError
+
+    async def delete_all_items(self, telegram_id: int) -> bool:
+        """Returns False if the basket was empty"""
+        raise NotImplementedError
+
+    async def delete_expired(self, expired_before: datetime.datetime) -> typing.List[int]:
+        """
+        Deletes the baskets nothing has been added to since expired_before.
+        Returns telegram_id for every deleted basket line.
+        """
+        raise NotImplementedError
+
+    async def close(self) -> None:
+        raise NotImplementedError
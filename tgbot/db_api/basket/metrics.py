@@ -0,0 +1,24 @@
+import datetime
+import typing
+from dataclasses import dataclass
+
+
+@dataclass
+class BasketSweeperMetrics:
+    """Results of the periodic clearing of expired baskets"""
+    runs: int = 0
+    purged_rows_total: int = 0
+    purged_baskets_total: int = 0
+    last_purged_rows: int = 0
+    last_purged_baskets: int = 0
+    last_run_at: typing.Optional[datetime.datetime] = None
+    last_duration: float = 0.0
+
+    def on_run(self, purged_rows: int, purged_baskets: int, duration: float):
+        self.runs += 1
+        self.purged_rows_total += purged_rows
+        self.purged_baskets_total += purged_baskets
+        self.last_purged_rows = purged_rows
+        self.last_purged_baskets = purged_baskets
+        self.last_run_at = datetime.datetime.utcnow()
+        self.last_duration = duration
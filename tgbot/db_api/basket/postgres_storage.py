@@ -0,0 +1,55 @@
+import datetime
+import typing
+
+from asyncpg import Record
+
+from tgbot.db_api import queries
+from tgbot.db_api.basket.abstract import BasketStorage
+
+if typing.TYPE_CHECKING:
+    from tgbot.db_api.postgres_db import Database
+
+
+class PostgresBasketStorage(BasketStorage):
+    """Baskets in the "basket" table, cleared by the scheduler"""
+
+    def __init__(self, db: 'Database'):
+        self.db = db
+
+    async def select_items(self, telegram_id: int) -> typing.List[Record]:
+        return await self.db.fetch(queries.SELECT_ITEMS_FROM_BASKET, telegram_id)
+
+    async def count_items(self, telegram_id: int) -> int:
+        return await self.db.fetchval(queries.COUNT_ITEMS_IN_BASKET, telegram_id)
+
+    async def add_item(self, telegram_id: int, item_id: int, quantity: int, added_at: datetime.datetime,
+                       max_lines: int, max_payload_length: int) -> typing.Optional[Record]:
+        return await self.db.fetchrow(queries.ADD_ITEM_TO_BASKET, telegram_id, item_id, quantity, added_at,
+                                      max_lines, max_payload_length,
+                                      lock=(queries.LOCK_USER_BASKET, (telegram_id,)))
+
+    async def reconcile(self, telegram_id: int, changed_at: datetime.datetime) -> typing.List[Record]:
+        return await self.db.fetch(queries.RECONCILE_BASKET, telegram_id, changed_at)
+
+    @staticmethod
+    def get_rows_count(status: str) -> int:
+        # статус команды вида "DELETE 3"
+        return int(status.split()[-1])
+
+    async def delete_item(self, telegram_id: int, item_id: int) -> bool:
+        sql = """DELETE FROM basket WHERE telegram_id=$1 AND item_id=$2"""
+        status = await self.db.execute(sql, telegram_id, item_id, execute=True)
+        return self.get_rows_count(status) > 0
+
+    async def delete_all_items(self, telegram_id: int) -> bool:
+        sql = """DELETE FROM basket WHERE telegram_id=$1"""
+        status = await self.db.execute(sql, telegram_id, execute=True)
+        return self.get_rows_count(status) > 0
+
+    async def delete_expired(self, expired_before: datetime.datetime) -> typing.List[int]:
+        records = await self.db.fetch(queries.DELETE_EXPIRED_BASKETS, expired_before)
+        return [record.get('telegram_id') for record in records]
+
+    async def close(self) -> None:
+        # пул соединений закрывается вместе с Database
+        return
@@ -0,0 +1,160 @@
+import datetime
+import typing
+
+from aioredis import Redis
+
+from tgbot.db_api import queries
+from tgbot.db_api.basket.abstract import BasketStorage
+
+if typing.TYPE_CHECKING:
+    from tgbot.db_api.postgres_db import Database
+
+# KEYS[1] - корзина; ARGV: item_id, количество, время добавления, максимум строк,
+# максимальная длина payload, остаток на складе, время жизни корзины.
+# Возвращает {1, новое количество}, если товар добавлен, {0, количество в корзине}, если не хватает товара на складе,
+# и {-1, количество в корзине}, если корзина заполнена
+ADD_ITEM_SCRIPT = """
+local lines = redis.call('HGETALL', KEYS[1])
+local payload_length = 1
+for i = 1, #lines, 2 do
+    payload_length = payload_length + string.len(lines[i]) + string.len(string.match(lines[i + 1], '^%d+')) + 2
+end
+local quantity_in_basket = 0
+local line = redis.call('HGET', KEYS[1], ARGV[1])
+if line then
+    quantity_in_basket = tonumber(string.match(line, '^%d+'))
+end
+if #lines / 2 > tonumber(ARGV[4]) or payload_length > tonumber(ARGV[5]) then
+    return {-1, quantity_in_basket}
+end
+local quantity = quantity_in_basket + tonumber(ARGV[2])
+if quantity > tonumber(ARGV[6]) then
+    return {0, quantity_in_basket}
+end
+redis.call('HSET', KEYS[1], ARGV[1], quantity .. ':' .. ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[7])
+return {1, quantity}
+"""
+
+
+class RedisBasketStorage(BasketStorage):
+    """
+    Every basket is a Redis hash "basket:{telegram_id}" of item_id -> "quantity:added_at".
+    The hash expires ttl seconds after the last change, names and prices of the goods are taken from Postgres.
+    """
+
+    expires_by_itself = True
+
+    def __init__(self, db: 'Database', redis: Redis, ttl: int):
+        self.db = db
+        self.redis = redis
+        self.ttl = ttl
+        self._add_item_script = redis.register_script(ADD_ITEM_SCRIPT)
+
+    @staticmethod
+    def get_key(telegram_id: int) -> str:
+        return f'basket:{telegram_id}'
+
+    @staticmethod
+    def dump_line(quantity: int, added_at: datetime.datetime) -> str:
+        return f'{quantity}:{added_at.isoformat()}'
+
+    @staticmethod
+    def load_line(line: str) -> typing.Tuple[int, datetime.datetime]:
+        quantity, added_at = line.split(':', 1)
+        return int(quantity), datetime.datetime.fromisoformat(added_at)
+
+    async def get_items_records(self, telegram_id: int, item_ids: typing.List[int]) -> dict:
+        records = await self.db.fetch(queries.GET_BASKET_ITEMS, telegram_id, item_ids)
+        return {record.get('item_id'): record for record in records}
+
+    @staticmethod
+    def make_line(item_record, quantity: typing.Optional[int], added_at: typing.Optional[datetime.datetime]) -> dict:
+        return dict(full_name=item_record.get('full_name'),
+                    item_id=item_record.get('item_id'),
+                    item_name=item_record.get('item_name'),
+                    quantity=quantity,
+                    item_price=item_record.get('item_price'),
+                    added_at=added_at)
+
+    async def select_items(self, telegram_id: int) -> typing.List[dict]:
+        lines = await self.redis.hgetall(self.get_key(telegram_id))
+        if not lines:
+            return []
+        lines = {int(item_id): self.load_line(line) for item_id, line in lines.items()}
+        items_records = await self.get_items_records(telegram_id, list(lines))
+        # строки удаленных товаров не показываются
+        basket = [self.make_line(items_records[item_id], quantity, added_at)
+                  for item_id, (quantity, added_at) in lines.items() if item_id in items_records]
+        return sorted(basket, key=lambda basket_line: basket_line['added_at'])
+
+    async def count_items(self, telegram_id: int) -> int:
+        return await self.redis.hlen(self.get_key(telegram_id))
+
+    async def add_item(self, telegram_id: int, item_id: int, quantity: int, added_at: datetime.datetime,
+                       max_lines: int, max_payload_length: int) -> typing.Optional[dict]:
+        items_records = await self.get_items_records(telegram_id, [item_id])
+        item_record = items_records.get(item_id)
+        if not item_record:
+            return
+        item_total_quantity = item_record.get('item_total_quantity')
+        status, quantity_in_basket = await self._add_item_script(
+            keys=[self.get_key(telegram_id)],
+            args=[item_id, quantity, added_at.isoformat(), max_lines, max_payload_length, item_total_quantity,
+                  self.ttl])
+        if status == 1:
+            result = self.make_line(item_record, quantity_in_basket, added_at)
+            quantity_in_basket -= quantity
+        else:
+            result = self.make_line(item_record, None, None)
+        result.update(item_total_quantity=item_total_quantity, quantity_in_basket=quantity_in_basket,
+                      basket_is_full=status == -1)
+        return result
+
+    async def reconcile(self, telegram_id: int, changed_at: datetime.datetime) -> typing.List[dict]:
+        key = self.get_key(telegram_id)
+        lines = await self.redis.hgetall(key)
+        if not lines:
+            return []
+        lines = {int(item_id): self.load_line(line) for item_id, line in lines.items()}
+        items_records = await self.get_items_records(telegram_id, list(lines))
+        basket = []
+        deleted_item_ids = []
+        updated_lines = {}
+        for item_id, (quantity, added_at) in lines.items():
+            item_record = items_records.get(item_id)
+            if not item_record:
+                # удаленные товары не показываются в корзине, поэтому просто убираются из нее
+                deleted_item_ids.append(item_id)
+                continue
+            item_total_quantity = item_record.get('item_total_quantity')
+            basket_line = self.make_line(item_record, quantity, added_at)
+            basket_line.update(deleted=False, updated=False)
+            if item_record.get('item_discontinued') or item_total_quantity <= 0:
+                basket_line.update(deleted=True)
+                deleted_item_ids.append(item_id)
+            elif quantity > item_total_quantity:
+                basket_line.update(quantity=item_total_quantity, added_at=changed_at, updated=True)
+                updated_lines[str(item_id)] = self.dump_line(item_total_quantity, changed_at)
+            basket.append(basket_line)
+        if deleted_item_ids or updated_lines:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                if deleted_item_ids:
+                    pipe.hdel(key, *map(str, deleted_item_ids))
+                if updated_lines:
+                    pipe.hset(key, mapping=updated_lines)
+                await pipe.execute()
+        return sorted(basket, key=lambda basket_line: lines[basket_line['item_id']][1])
+
+    async def delete_item(self, telegram_id: int, item_id: int) -> bool:
+        return await self.redis.hdel(self.get_key(telegram_id), str(item_id)) > 0
+
+    async def delete_all_items(self, telegram_id: int) -> bool:
+        return await self.redis.delete(self.get_key(telegram_id)) > 0
+
+    async def delete_expired(self, expired_before: datetime.datetime) -> typing.List[int]:
+        # корзины удаляет сам Redis по истечении TTL
+        return []
+
+    async def close(self) -> None:
+        await self.redis.close()
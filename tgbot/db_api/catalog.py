@@ -0,0 +1,150 @@
+import typing
+from dataclasses import dataclass, field
+
+from asyncpg import Record
+
+
+@dataclass
+class CatalogItem:
+    item_id: int
+    item_name: str
+
+
+@dataclass
+class CatalogSubcategory:
+    item_subcategory_name: typing.Optional[str]
+    item_subcategory_code: typing.Optional[int]
+    items: typing.List[CatalogItem] = field(default_factory=list)
+    item_positions: typing.Dict[int, int] = field(default_factory=dict)
+
+
+@dataclass
+class CatalogCategory:
+    item_category_name: str
+    item_category_code: int
+    has_subcategories: bool
+    items_count: int
+    subcategories: typing.Dict[typing.Optional[int], CatalogSubcategory] = field(default_factory=dict)
+    items: typing.List[CatalogItem] = field(default_factory=list)
+    item_positions: typing.Dict[int, int] = field(default_factory=dict)
+
+
+class Catalog:
+    """
+    Tree of the visible goods: category -> subcategory -> items.
+    It is not changed after building, so a handler may use it across awaits.
+    """
+
+    def __init__(self, categories: typing.Dict[int, CatalogCategory]):
+        self._categories = categories
+
+    @classmethod
+    def build(cls, items_records: typing.List[Record]) -> 'Catalog':
+        # категории, их признаки и количество товаров берутся из тех же строк, что и товары,
+        # поэтому не могут с ними разойтись
+        categories: typing.Dict[int, CatalogCategory] = {}
+        positions: typing.Dict[int, typing.List[typing.Tuple[int, CatalogItem]]] = {}
+        for record in items_records:
+            item_category_code = record.get('item_category_code')
+            item_subcategory_code = record.get('item_subcategory_code')
+            category = categories.get(item_category_code)
+            if not category:
+                category = CatalogCategory(record.get('item_category_name'), item_category_code,
+                                           has_subcategories=False, items_count=0)
+                categories[item_category_code] = category
+                positions[item_category_code] = []
+            category.items_count += 1
+            if record.get('item_subcategory_name'):
+                category.has_subcategories = True
+            subcategory = category.subcategories.get(item_subcategory_code)
+            if not subcategory:
+                subcategory = CatalogSubcategory(record.get('item_subcategory_name'), item_subcategory_code)
+                category.subcategories[item_subcategory_code] = subcategory
+            item = CatalogItem(record.get('item_id'), record.get('item_name'))
+            subcategory.items.append(item)
+            positions[item_category_code].append((record.get('position'), item))
+        for item_category_code, category in categories.items():
+            category.items = [item for _, item in sorted(positions[item_category_code], key=lambda pair: pair[0])]
+            category.item_positions = {item.item_id: index for index, item in enumerate(category.items)}
+            for subcategory in category.subcategories.values():
+                subcategory.item_positions = {item.item_id: index for index, item in enumerate(subcategory.items)}
+        return cls(categories)
+
+    def categories(self) -> typing.List[CatalogCategory]:
+        return list(self._categories.values())
+
+    def get_category(self, item_category_code: int) -> typing.Optional[CatalogCategory]:
+        return self._categories.get(item_category_code)
+
+    def subcategories(self, item_category_code: int) -> typing.List[CatalogSubcategory]:
+        category = self.get_category(item_category_code)
+        return list(category.subcategories.values()) if category else []
+
+    def has_subcategories(self, item_category_code: int) -> bool:
+        category = self.get_category(item_category_code)
+        return category.has_subcategories if category else False
+
+    def _get_group(self, item_category_code: int, item_subcategory_code: typing.Optional[int] = None) -> \
+            typing.Union[CatalogCategory, CatalogSubcategory, None]:
+        category = self.get_category(item_category_code)
+        if category and item_subcategory_code:
+            return category.subcategories.get(item_subcategory_code)
+        return category
+
+    def items(self, item_category_code: int, item_subcategory_code: typing.Optional[int] = None) -> \
+            typing.List[CatalogItem]:
+        group = self._get_group(item_category_code, item_subcategory_code)
+        return list(group.items) if group else []
+
+    def next_item_id(self, item_category_code: int, item_subcategory_code: typing.Optional[int], item_id: int,
+                     scroll_direction: str) -> typing.Tuple[typing.Optional[int], int]:
+        """
+        Returns the id of the item next to item_id in the category (or subcategory) in the scroll direction,
+        going round at the ends, and the number of items there.
+        If item_id is not in the list any more, the first item is returned.
+        """
+        group = self._get_group(item_category_code, item_subcategory_code)
+        if not group or not group.items:
+            return None, 0
+        items_quantity = len(group.items)
+        position = group.item_positions.get(item_id)
+        if position is None:
+            return group.items[0].item_id, items_quantity
+        step = 1 if scroll_direction == 'right' else -1
+        return group.items[(position + step) % items_quantity].item_id, items_quantity
+
+
+class CatalogCache:
+    """
+    The last built Catalog. It is built by Database.get_catalog() and dropped on every write to the "items" table.
+    """
+
+    def __init__(self):
+        self._catalog: typing.Optional[Catalog] = None
+        self._version = 0
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._catalog is not None
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def get(self) -> typing.Optional[Catalog]:
+        return self._catalog
+
+    def invalidate(self):
+        self._catalog = None
+        self._version += 1
+
+    def load(self, items_records: typing.List[Record], version: int) -> Catalog:
+        """
+        Builds the tree from the rows of Database.get_catalog_from_items().
+        The tree is returned in any case, but it is not saved if the cache was invalidated while the rows were
+        being fetched.
+        """
+        catalog = Catalog.build(items_records)
+        if version == self._version:
+            self._catalog = catalog
+        return catalog
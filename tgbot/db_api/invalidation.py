@@ -0,0 +1,80 @@
+import asyncio
+import json
+import logging
+import typing
+
+from aioredis import Redis
+from aioredis.exceptions import RedisError
+
+if typing.TYPE_CHECKING:
+    from tgbot.db_api.postgres_db import Database
+
+logger = logging.getLogger(__name__)
+
+CACHE_INVALIDATION_CHANNEL = 'cache_invalidation'
+
+
+class CacheInvalidationBus:
+    """
+    Spreads the invalidation of the in-memory caches of Database (goods, catalog, basket counts) between the bot
+    processes through Redis pub/sub. Database publishes its own changes, the changes of the other processes are
+    applied without publishing them again.
+    """
+
+    def __init__(self, redis: Redis, worker_id: str, channel: str = CACHE_INVALIDATION_CHANNEL):
+        self.redis = redis
+        self.worker_id = worker_id
+        self.channel = channel
+        self.db: typing.Optional['Database'] = None
+        self._listener: typing.Optional[asyncio.Task] = None
+        self._publishing: typing.Set[asyncio.Task] = set()
+
+    def publish(self, event: str, ids: typing.Iterable[int] = ()):
+        message = json.dumps(dict(worker=self.worker_id, event=event, ids=list(ids)))
+        task = asyncio.create_task(self._publish(message))
+        self._publishing.add(task)
+        task.add_done_callback(self._publishing.discard)
+
+    async def _publish(self, message: str):
+        try:
+            await self.redis.publish(self.channel, message)
+        except (RedisError, OSError):
+            # остальные процессы увидят изменения, когда истечет время жизни их кэшей
+            logger.exception('Cache invalidation has not been published: %s', message)
+
+    def apply(self, message: dict):
+        if message['worker'] == self.worker_id:
+            return
+        ids = message['ids']
+        if message['event'] == 'items':
+            self.db.on_items_changed(*ids, broadcast=False)
+        elif message['event'] == 'basket':
+            self.db.on_basket_changed(ids[0] if ids else None, broadcast=False)
+
+    async def listen(self):
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    if message['type'] == 'message':
+                        self.apply(json.loads(message['data']))
+            except (RedisError, OSError):
+                logger.exception('Cache invalidation channel has been disconnected')
+                # сообщения, пришедшие без подписки, потеряны, поэтому кэши сбрасываются целиком
+                self.db.on_items_changed(broadcast=False)
+                self.db.on_basket_changed(broadcast=False)
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.close()
+
+    def start(self, db: 'Database'):
+        self.db = db
+        db.cache_invalidation = self
+        self._listener = asyncio.create_task(self.listen())
+
+    async def close(self):
+        if self._listener:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+        await asyncio.gather(*self._publishing, return_exceptions=True)
@@ -0,0 +1,156 @@
+import datetime
+from typing import NamedTuple, Tuple
+
+from tgbot.db_api import queries
+
+# ключ pg_advisory_lock, чтобы миграции не запускались одновременно из нескольких процессов
+MIGRATIONS_LOCK_ID = 20211101
+
+CREATE_TABLE_SCHEMA_MIGRATIONS = """CREATE TABLE IF NOT EXISTS schema_migrations (
+version integer PRIMARY KEY,
+description varchar(255) NOT NULL,
+applied_at timestamp NOT NULL
+)"""
+
+CREATE_TABLE_USERS = """CREATE TABLE IF NOT EXISTS users(
+telegram_id bigint NOT NULL UNIQUE PRIMARY KEY,
+username varchar(100) NULL,
+full_name varchar(100) NOT NULL,
+email varchar(100) NULL,
+first_login_time timestamp NOT NULL,
+referer_telegram_id bigint NULL
+)"""
+
+CREATE_TABLE_ITEMS = """CREATE TABLE IF NOT EXISTS items (
+item_id serial PRIMARY KEY,
+item_category_name varchar(30) NOT NULL,
+item_category_code int NOT NULL,
+item_subcategory_name varchar(30) NULL,
+item_subcategory_code int NULL,
+item_name varchar(30) NOT NULL UNIQUE,
+item_photos varchar(100) ARRAY NOT NULL,
+item_price integer NOT NULL,
+item_description text NOT NULL,
+item_short_description varchar(80) NULL,
+item_total_quantity smallint NOT NULL,
+item_discontinued boolean NOT NULL,
+item_photo_url varchar(255) NOT NULL
+)"""
+
+CREATE_TABLE_BASKET = """CREATE TABLE IF NOT EXISTS basket (
+telegram_id bigint NOT NULL,
+item_id integer NOT NULL,
+FOREIGN KEY (telegram_id) REFERENCES users(telegram_id),
+FOREIGN KEY (item_id) REFERENCES items(item_id),
+quantity smallint NOT NULL ,
+added_at timestamp NOT NULL
+)"""
+
+# в корзине могли остаться дубли одного товара, оставляем только последнюю запись
+DELETE_BASKET_DUPLICATES = """DELETE FROM basket WHERE ctid IN (
+SELECT ctid FROM (
+    SELECT ctid, ROW_NUMBER() OVER (PARTITION BY telegram_id, item_id ORDER BY added_at DESC) AS row_number
+    FROM basket
+) AS rows WHERE row_number > 1
+)"""
+
+ADD_BASKET_UNIQUE_CONSTRAINT = """ALTER TABLE basket
+ADD CONSTRAINT basket_telegram_id_item_id_key UNIQUE (telegram_id, item_id)"""
+
+CREATE_INDEX_BASKET_ITEM_ID = 'CREATE INDEX IF NOT EXISTS basket_item_id_idx ON basket (item_id)'
+
+CREATE_INDEX_ITEMS_VISIBLE = """CREATE INDEX IF NOT EXISTS items_visible_category_idx
+ON items (item_category_code, item_subcategory_code, item_name) INCLUDE (item_id)
+WHERE item_discontinued=FALSE AND item_total_quantity>0"""
+
+CREATE_INDEX_ITEMS_CATEGORY = """CREATE INDEX IF NOT EXISTS items_category_idx
+ON items (item_category_code, item_subcategory_code, item_name)"""
+
+CREATE_EXTENSION_PG_TRGM = 'CREATE EXTENSION IF NOT EXISTS pg_trgm'
+
+CREATE_INDEX_ITEMS_VISIBLE_NAME_TRGM = """CREATE INDEX IF NOT EXISTS items_visible_name_trgm_idx
+ON items USING gin (item_name gin_trgm_ops)
+WHERE item_discontinued=FALSE AND item_total_quantity>0"""
+
+CREATE_INDEX_BASKET_ADDED_AT = 'CREATE INDEX IF NOT EXISTS basket_added_at_idx ON basket (added_at)'
+
+CREATE_TABLE_ORDERS = """CREATE TABLE IF NOT EXISTS orders (
+order_id serial PRIMARY KEY,
+telegram_id bigint NOT NULL,
+FOREIGN KEY (telegram_id) REFERENCES users(telegram_id),
+created_at timestamp NOT NULL,
+from_basket boolean NOT NULL,
+total_amount integer NOT NULL,
+currency varchar(3) NOT NULL,
+shipping_option_id varchar(64) NULL,
+customer_name varchar(255) NULL,
+phone_number varchar(32) NULL,
+email varchar(100) NULL,
+shipping_address varchar(512) NULL,
+telegram_payment_charge_id varchar(255) NOT NULL UNIQUE,
+provider_payment_charge_id varchar(255) NOT NULL
+)"""
+
+# название и цена сохраняются в строке заказа, потому что товар потом могут изменить или удалить
+CREATE_TABLE_ORDER_LINES = """CREATE TABLE IF NOT EXISTS order_lines (
+order_id integer NOT NULL,
+FOREIGN KEY (order_id) REFERENCES orders(order_id) ON DELETE CASCADE,
+item_id integer NOT NULL,
+item_name varchar(30) NOT NULL,
+item_price integer NOT NULL,
+quantity smallint NOT NULL,
+out_of_stock boolean NOT NULL,
+PRIMARY KEY (order_id, item_id)
+)"""
+
+CREATE_INDEX_ORDERS_TELEGRAM_ID = """CREATE INDEX IF NOT EXISTS orders_telegram_id_created_at_idx
+ON orders (telegram_id, created_at)"""
+
+CREATE_INDEX_ORDERS_CREATED_AT = 'CREATE INDEX IF NOT EXISTS orders_created_at_idx ON orders (created_at)'
+
+CREATE_INDEX_ORDER_LINES_ITEM_ID = 'CREATE INDEX IF NOT EXISTS order_lines_item_id_idx ON order_lines (item_id)'
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    statements: Tuple[str, ...]
+
+
+MIGRATIONS = (
+    Migration(1, 'Таблицы users, items и basket',
+              (CREATE_TABLE_USERS, CREATE_TABLE_ITEMS, CREATE_TABLE_BASKET)),
+    Migration(2, 'Индексы товаров по категориям и уникальность товара в корзине',
+              (DELETE_BASKET_DUPLICATES, ADD_BASKET_UNIQUE_CONSTRAINT, CREATE_INDEX_BASKET_ITEM_ID,
+               CREATE_INDEX_ITEMS_VISIBLE, CREATE_INDEX_ITEMS_CATEGORY)),
+    Migration(3, 'Триграммный индекс для поиска товаров по названию',
+              (CREATE_EXTENSION_PG_TRGM, CREATE_INDEX_ITEMS_VISIBLE_NAME_TRGM)),
+    Migration(4, 'Индекс корзины по времени добавления для удаления просроченных корзин',
+              (CREATE_INDEX_BASKET_ADDED_AT,)),
+    Migration(5, 'Таблицы заказов orders и order_lines',
+              (CREATE_TABLE_ORDERS, CREATE_TABLE_ORDER_LINES, CREATE_INDEX_ORDERS_TELEGRAM_ID,
+               CREATE_INDEX_ORDERS_CREATED_AT, CREATE_INDEX_ORDER_LINES_ITEM_ID)),
+)
+
+
+class IndexCheck(NamedTuple):
+    index_name: str
+    sql: str
+    args: tuple
+
+
+# горячие запросы и индексы, которые они должны использовать (проверяется через EXPLAIN при запуске)
+INDEX_CHECKS = (
+    IndexCheck('items_visible_category_idx',
+               """SELECT * FROM items WHERE item_category_code=$1 AND item_subcategory_code=$2 AND
+               item_discontinued=FALSE AND item_total_quantity>0 ORDER BY item_name""", (1, 1)),
+    IndexCheck('items_visible_category_idx',
+               """SELECT * FROM items WHERE item_category_code=$1 AND
+               item_discontinued=FALSE AND item_total_quantity>0 ORDER BY item_name""", (1,)),
+    IndexCheck('basket_telegram_id_item_id_key', queries.SELECT_ITEMS_FROM_BASKET.sql, (1,)),
+    IndexCheck('basket_telegram_id_item_id_key', queries.COUNT_ITEMS_IN_BASKET.sql, (1,)),
+    IndexCheck('basket_item_id_idx', 'SELECT 1 FROM basket WHERE item_id=$1', (1,)),
+    IndexCheck('items_visible_name_trgm_idx', queries.SEARCH_VISIBLE_ITEMS_PAGE.sql,
+               ('подарок', '%подарок%', 'подарок%', 50, 0)),
+    IndexCheck('basket_added_at_idx', queries.DELETE_EXPIRED_BASKETS.sql, (datetime.datetime(2021, 11, 1),)),
+)
@@ -0,0 +1,48 @@
+from dataclasses import dataclass
+
+
+@dataclass
+class PoolStats:
+    size: int
+    idle_size: int
+    min_size: int
+    max_size: int
+    acquired: int
+    max_acquired: int
+    waiting: int
+    acquires_total: int
+    wait_time_avg: float
+    wait_time_max: float
+
+
+class PoolMetrics:
+    """Counters of Database.acquire(): how many connections are taken and how long the callers waited for them."""
+
+    def __init__(self):
+        self.acquired = 0
+        self.max_acquired = 0
+        self.waiting = 0
+        self.acquires_total = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def on_wait(self):
+        self.waiting += 1
+
+    def on_acquired(self, wait_time: float):
+        self.waiting -= 1
+        self.acquired += 1
+        self.max_acquired = max(self.max_acquired, self.acquired)
+        self.acquires_total += 1
+        self.wait_time_total += wait_time
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+
+    def on_acquire_failed(self):
+        self.waiting -= 1
+
+    def on_released(self):
+        self.acquired -= 1
+
+    @property
+    def wait_time_avg(self) -> float:
+        return self.wait_time_total / self.acquires_total if self.acquires_total else 0.0
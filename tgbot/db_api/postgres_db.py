@@ -1,44 +1,132 @@
+import asyncio
 import datetime
+import json
 import logging
-from typing import Union, Optional, List
-
-import asyncpg
-from asyncpg import Pool, create_pool, Connection
-
+import time
+from contextlib import asynccontextmanager
+from typing import Union, Optional, List, Any, Tuple, TYPE_CHECKING
+
+from asyncpg import Pool, create_pool, Connection, Record
+from asyncpg.exceptions import DeadlockDetectedError, UniqueViolationError
+
+from tgbot.db_api import queries
+from tgbot.db_api.basket.abstract import BasketStorage, BasketLine
+from tgbot.db_api.basket.metrics import BasketSweeperMetrics
+from tgbot.db_api.basket.postgres_storage import PostgresBasketStorage
+from tgbot.db_api.catalog import CatalogCache, Catalog
+from tgbot.db_api.migrations import MIGRATIONS, MIGRATIONS_LOCK_ID, CREATE_TABLE_SCHEMA_MIGRATIONS, INDEX_CHECKS, \
+    IndexCheck
+from tgbot.db_api.pool_metrics import PoolMetrics, PoolStats
+from tgbot.db_api.queries import Query
+from tgbot.misc.cache import TTLCache
+from tgbot.misc.job_context import get_job_context, DB_JOB_CONTEXT
+
+if TYPE_CHECKING:
+    from tgbot.db_api.invalidation import CacheInvalidationBus
 
 logger = logging.getLogger(__name__)
 
 
-async def delete_all_items_from_basket(dsn: str, telegram_id: int):
-    connection: Connection = await asyncpg.connect(dsn, command_timeout=10)
-    try:
-        async with connection.transaction():
-            sql = """DELETE FROM basket WHERE telegram_id=$1"""
-            await connection.execute(sql, telegram_id)
-    except Exception as err:
-        logger.info(err)
-    finally:
-        await connection.close()
+async def delete_all_items_from_basket(telegram_id: int, dsn: Optional[str] = None):
+    # задачи clear_basket_{telegram_id} из прошлых версий; dsn не используется, соединение берется из пула бота
+    db: Database = get_job_context(DB_JOB_CONTEXT)
+    await db.delete_all_items_from_basket(telegram_id)
 
 
 class Database:
 
-    def __init__(self, url: str):
+    def __init__(self, url: str, min_size: int = 10, max_size: int = 10,
+                 max_inactive_connection_lifetime: float = 300.0, statement_cache_size: int = 100,
+                 command_timeout: Optional[float] = None, basket_storage: Optional[BasketStorage] = None):
         self.pool: Union[Pool, None] = None
         self.url = url
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_inactive_connection_lifetime = max_inactive_connection_lifetime
+        self.statement_cache_size = statement_cache_size
+        self.command_timeout = command_timeout
+        self.pool_metrics = PoolMetrics()
+        self.catalog = CatalogCache()
+        self._catalog_lock = asyncio.Lock()
+        self.items_version = 0
+        self.items_cache = TTLCache(maxsize=1024, ttl=300)
+        self.basket_version = 0
+        self.basket_counts = TTLCache(maxsize=10000, ttl=300)
+        self.basket_storage = basket_storage or PostgresBasketStorage(self)
+        self.basket_sweeper_metrics = BasketSweeperMetrics()
+        # рассылает сброс кэшей другим процессам бота, если их несколько
+        self.cache_invalidation: Optional['CacheInvalidationBus'] = None
 
     async def connect_to_database(self):
         self.pool = await create_pool(
-            dsn=self.url
+            dsn=self.url,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            max_inactive_connection_lifetime=self.max_inactive_connection_lifetime,
+            statement_cache_size=self.statement_cache_size,
+            command_timeout=self.command_timeout
         )
 
+    @asynccontextmanager
+    async def acquire(self):
+        self.pool_metrics.on_wait()
+        started_at = time.monotonic()
+        try:
+            connection = await self.pool.acquire()
+        except BaseException:
+            self.pool_metrics.on_acquire_failed()
+            raise
+        self.pool_metrics.on_acquired(time.monotonic() - started_at)
+        try:
+            yield connection
+        finally:
+            self.pool_metrics.on_released()
+            await self.pool.release(connection)
+
+    def get_pool_stats(self) -> PoolStats:
+        return PoolStats(size=self.pool.get_size(),
+                         idle_size=self.pool.get_idle_size(),
+                         min_size=self.pool.get_min_size(),
+                         max_size=self.pool.get_max_size(),
+                         acquired=self.pool_metrics.acquired,
+                         max_acquired=self.pool_metrics.max_acquired,
+                         waiting=self.pool_metrics.waiting,
+                         acquires_total=self.pool_metrics.acquires_total,
+                         wait_time_avg=self.pool_metrics.wait_time_avg,
+                         wait_time_max=self.pool_metrics.wait_time_max)
+
+    async def _fetch_query(self, method: str, query: Query, *args, lock: Optional[Tuple[Query, tuple]] = None):
+        """
+        The query is prepared once per connection by the statement cache of asyncpg and then is sent
+        without parsing, the same way a PreparedStatement would be.
+        lock - query with its arguments which locks rows before the query in the same transaction,
+        so the query sees everything committed by the previous holder of the lock.
+        """
+        async with self.acquire() as connection:
+            connection: Connection
+            if lock:
+                lock_query, lock_args = lock
+                async with connection.transaction():
+                    await connection.execute(lock_query.sql, *lock_args)
+                    return await getattr(connection, method)(query.sql, *args)
+            return await getattr(connection, method)(query.sql, *args)
+
+    async def fetch(self, query: Query, *args) -> List[Record]:
+        return await self._fetch_query('fetch', query, *args)
+
+    async def fetchrow(self, query: Query, *args, lock: Optional[Tuple[Query, tuple]] = None) -> Optional[Record]:
+        return await self._fetch_query('fetchrow', query, *args, lock=lock)
+
+    async def fetchval(self, query: Query, *args) -> Any:
+        return await self._fetch_query('fetchval', query, *args)
+
     async def execute(self, command, *args,
                       fetch: bool = False,
                       fetchval: bool = False,
                       fetchrow: bool = False,
                       execute: bool = False
                       ):
-        async with self.pool.acquire() as connection:
+        async with self.acquire() as connection:
             connection: Connection
             async with connection.transaction():
                 if fetch:
@@ -51,13 +139,95 @@ class Database:
                     result = await connection.execute(command, *args)
             return result
 
+    async def migrate(self) -> List[int]:
+        applied_versions = []
+        async with self.acquire() as connection:
+            connection: Connection
+            await connection.execute('SELECT pg_advisory_lock($1)', MIGRATIONS_LOCK_ID)
+            try:
+                await connection.execute(CREATE_TABLE_SCHEMA_MIGRATIONS)
+                current_version = await connection.fetchval('SELECT COALESCE(MAX(version), 0) FROM schema_migrations')
+                for migration in MIGRATIONS:
+                    if migration.version <= current_version:
+                        continue
+                    async with connection.transaction():
+                        for statement in migration.statements:
+                            await connection.execute(statement)
+                        await connection.execute('INSERT INTO schema_migrations VALUES ($1, $2, $3)',
+                                                 migration.version, migration.description,
+                                                 datetime.datetime.utcnow())
+                    logger.info('Migration %s "%s" has been applied', migration.version, migration.description)
+                    applied_versions.append(migration.version)
+            finally:
+                await connection.execute('SELECT pg_advisory_unlock($1)', MIGRATIONS_LOCK_ID)
+        if applied_versions:
+            self.on_items_changed()
+            # соединения пересоздаются, чтобы кэш запросов asyncpg не хранил планы под старую схему
+            await self.pool.expire_connections()
+        return applied_versions
+
+    @staticmethod
+    def get_used_indexes(plan: dict) -> List[str]:
+        indexes = [plan['Index Name']] if 'Index Name' in plan else []
+        for subplan in plan.get('Plans', []):
+            indexes.extend(Database.get_used_indexes(subplan))
+        return indexes
+
+    async def explain_index_check(self, index_check: IndexCheck) -> List[str]:
+        async with self.acquire() as connection:
+            connection: Connection
+            async with connection.transaction():
+                # на маленьких таблицах планировщик предпочитает seq scan, поэтому он отключается
+                await connection.execute('SET LOCAL enable_seqscan = off')
+                explained = await connection.fetchval('EXPLAIN (FORMAT JSON) ' + index_check.sql, *index_check.args)
+        plan = json.loads(explained)[0]['Plan']
+        return self.get_used_indexes(plan)
+
+    async def check_indexes_usage(self) -> List[IndexCheck]:
+        failed_checks = []
+        for index_check in INDEX_CHECKS:
+            used_indexes = await self.explain_index_check(index_check)
+            if index_check.index_name not in used_indexes:
+                logger.warning('Index "%s" is not used by query:\n%s\nUsed indexes: %s',
+                               index_check.index_name, index_check.sql, used_indexes)
+                failed_checks.append(index_check)
+        return failed_checks
+
+    def on_items_changed(self, *item_ids: int, broadcast: bool = True):
+        self.items_version += 1
+        self.catalog.invalidate()
+        if item_ids:
+            for item_id in item_ids:
+                self.items_cache.pop(item_id)
+        else:
+            self.items_cache.clear()
+        if broadcast and self.cache_invalidation:
+            self.cache_invalidation.publish('items', item_ids)
+
+    def on_basket_changed(self, telegram_id: Optional[int] = None, broadcast: bool = True):
+        self.basket_version += 1
+        if telegram_id:
+            self.basket_counts.pop(telegram_id)
+        else:
+            self.basket_counts.clear()
+        if broadcast and self.cache_invalidation:
+            self.cache_invalidation.publish('basket', [telegram_id] if telegram_id else [])
+
+    def on_table_changed(self, table_name: str):
+        if table_name == 'items':
+            self.on_items_changed()
+        # корзина ссылается на товары и пользователей, поэтому сбрасывается вместе с ними
+        self.on_basket_changed()
+
     async def drop_table(self, table_name: str):
         sql = f'DROP TABLE IF EXISTS {table_name} CASCADE'
         await self.execute(sql, execute=True)
+        self.on_table_changed(table_name)
 
     async def del_all_items_from_table(self, table_name: str):
         sql = f'DELETE FROM {table_name} WHERE TRUE'
         await self.execute(sql, execute=True)
+        self.on_table_changed(table_name)
 
     async def select_all_items_from_table(self, table_name: str):
         sql = f'SELECT * FROM {table_name}'
@@ -77,16 +247,8 @@ class Database:
         sql, parameters = self.format_args(table_name, kwargs)
         return await self.execute(sql, *parameters, fetchrow=True)
 
-    async def create_table_users(self):
-        sql = """CREATE TABLE IF NOT EXISTS users(
-        telegram_id bigint NOT NULL UNIQUE PRIMARY KEY,
-        username varchar(100) NULL,
-        full_name varchar(100) NOT NULL,
-        email varchar(100) NULL,
-        first_login_time timestamp NOT NULL,
-        referer_telegram_id bigint NULL
-        )"""
-        await self.execute(sql, execute=True)
+    async def select_user(self, telegram_id: int) -> Optional[Record]:
+        return await self.fetchrow(queries.GET_USER, telegram_id)
 
     async def add_new_user(self, telegram_id: int, username: Optional[str], full_name: str, email: Optional[str],
                            first_login_time: datetime.datetime, referer_telegram_id: Optional[int]):
@@ -102,24 +264,6 @@ class Database:
         sql = 'UPDATE users SET email=$1 WHERE telegram_id=$2'
         await self.execute(sql, email, telegram_id, execute=True)
 
-    async def create_table_items(self):
-        sql = """CREATE TABLE IF NOT EXISTS items (
-        item_id serial PRIMARY KEY,
-        item_category_name varchar(30) NOT NULL,
-        item_category_code int NOT NULL,
-        item_subcategory_name varchar(30) NULL,
-        item_subcategory_code int NULL,
-        item_name varchar(30) NOT NULL UNIQUE,
-        item_photos varchar(100) ARRAY NOT NULL,
-        item_price integer NOT NULL,
-        item_description text NOT NULL,
-        item_short_description varchar(80) NULL,
-        item_total_quantity smallint NOT NULL,
-        item_discontinued boolean NOT NULL,
-        item_photo_url varchar(255) NOT NULL
-        );"""
-        await self.execute(sql, execute=True)
-
     async def get_categories_from_items(self, for_admins: bool = False):
         if for_admins:
             sql = """SELECT DISTINCT item_category_name, item_category_code FROM items ORDER BY item_category_name"""
@@ -184,9 +328,37 @@ class Database:
                 item_discontinued=FALSE AND item_total_quantity>0 ORDER BY item_name"""
             return await self.execute(sql, item_category_code, fetch=True)
 
-    async def get_item_from_items(self, item_id: int):
-        sql = 'SELECT * FROM items WHERE item_id=$1'
-        return await self.execute(sql, item_id, fetchrow=True)
+    async def get_item_from_items(self, item_id: int) -> Optional[Record]:
+        return await self.fetchrow(queries.GET_ITEM, item_id)
+
+    async def get_items_by_ids(self, item_ids: List[int]) -> List[Record]:
+        return await self.fetch(queries.GET_ITEMS_BY_IDS, item_ids)
+
+    async def get_catalog_from_items(self) -> List[Record]:
+        return await self.fetch(queries.GET_CATALOG)
+
+    async def get_catalog(self) -> Catalog:
+        catalog = self.catalog.get()
+        if catalog:
+            return catalog
+        async with self._catalog_lock:
+            catalog = self.catalog.get()
+            if catalog:
+                return catalog
+            version = self.catalog.version
+            items_records = await self.get_catalog_from_items()
+            # если товары поменялись во время запроса, дерево не сохраняется, но этот запрос обслуживается им
+            return self.catalog.load(items_records, version)
+
+    async def get_next_visible_item_id(self, item_category_code: int, item_subcategory_code: Optional[int],
+                                       item_name: str, item_id: int,
+                                       scroll_direction: str) -> Tuple[Optional[int], int]:
+        """The same as Catalog.next_item_id(), but from the table"""
+        query = queries.NEXT_VISIBLE_ITEM if scroll_direction == 'right' else queries.PREVIOUS_VISIBLE_ITEM
+        record = await self.fetchrow(query, item_category_code, item_subcategory_code or None, item_name, item_id)
+        if not record:
+            return None, 0
+        return record.get('item_id'), record.get('items_quantity')
 
     async def get_items_ids_from_items(self):
         sql = 'SELECT item_id FROM items ORDER BY item_id'
@@ -213,33 +385,84 @@ class Database:
                                  ):
         if item_id:
             sql = "INSERT INTO items VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13) RETURNING *"
-            return await self.execute(sql, item_id, item_category_name, item_category_code, item_subcategory_name,
+            item = await self.execute(sql, item_id, item_category_name, item_category_code, item_subcategory_name,
                                       item_subcategory_code, item_name, item_photos, item_price, item_description,
                                       item_short_description, item_total_quantity, item_discontinued, item_photo_url,
                                       fetchrow=True)
         else:
             sql = "INSERT INTO items VALUES (DEFAULT, $1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12) RETURNING *"
-            return await self.execute(sql, item_category_name, item_category_code, item_subcategory_name,
+            item = await self.execute(sql, item_category_name, item_category_code, item_subcategory_name,
                                       item_subcategory_code, item_name, item_photos, item_price, item_description,
                                       item_short_description, item_total_quantity, item_discontinued, item_photo_url,
                                       fetchrow=True)
+        self.on_items_changed(item.get('item_id'))
+        return item
 
-    async def select_items_like(self, name_starts_with: str):
-        sql = f"SELECT * FROM items WHERE item_name ILIKE '{name_starts_with}%' AND " \
-              f"item_discontinued=FALSE and items.item_total_quantity>0"
-        return await self.execute(sql, fetch=True)
+    @staticmethod
+    def escape_like(text: str) -> str:
+        return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+    async def select_items_like(self, text: str, limit: int, offset: int = 0) -> List[Record]:
+        text = text.strip()
+        if not text:
+            return await self.fetch(queries.SELECT_VISIBLE_ITEMS_PAGE, limit, offset)
+        pattern = self.escape_like(text)
+        return await self.fetch(queries.SEARCH_VISIBLE_ITEMS_PAGE, text, f'%{pattern}%', f'{pattern}%', limit, offset)
 
     async def update_item_from_items(self, item_id, parameter, value):
         sql = f"""UPDATE items SET {parameter}=$1 WHERE item_id=$2 RETURNING *"""
-        return await self.execute(sql, value, item_id, fetchrow=True)
+        item = await self.execute(sql, value, item_id, fetchrow=True)
+        if parameter == 'item_id':
+            self.on_items_changed(item_id, value)
+        else:
+            self.on_items_changed(item_id)
+        return item
+
+    async def _fetch_with_deadlock_retry(self, query: Query, *args, attempts: int = 3) -> List[Record]:
+        for attempt in range(1, attempts + 1):
+            try:
+                return await self.fetch(query, *args)
+            except DeadlockDetectedError:
+                # одновременные оплаты нескольких одинаковых товаров могут заблокировать друг друга
+                if attempt == attempts:
+                    raise
+                logger.warning('Deadlock in "%s", attempt %s', query.name, attempt)
+
+    async def create_order(self, ordered_items: List[Tuple[int, int]], telegram_id: int,
+                           created_at: datetime.datetime, from_basket: bool, total_amount: int, currency: str,
+                           shipping_option_id: Optional[str], customer_name: Optional[str],
+                           phone_number: Optional[str], email: Optional[str], shipping_address: Optional[str],
+                           telegram_payment_charge_id: str, provider_payment_charge_id: str) -> List[Record]:
+        """
+        Takes the paid goods (item_id, quantity) from the stock and saves the order with its lines in one statement.
+        Goods which are not enough in stock are not taken and are returned with out_of_stock=True.
+        Returns the sold goods with order_id. The payment is taken only once: for a telegram_payment_charge_id
+        which already has an order nothing is taken and the saved order is returned.
+        """
+        item_ids = [item_id for item_id, _ in ordered_items]
+        quantities = [quantity for _, quantity in ordered_items]
+        try:
+            sold_items = await self._fetch_with_deadlock_retry(
+                queries.CREATE_ORDER, item_ids, quantities, telegram_id, created_at, from_basket, total_amount,
+                currency, shipping_option_id, customer_name, phone_number, email, shipping_address,
+                telegram_payment_charge_id, provider_payment_charge_id)
+        except UniqueViolationError as error:
+            if error.constraint_name != 'orders_telegram_payment_charge_id_key':
+                raise
+            logger.warning('Order for the payment %s has already been saved', telegram_payment_charge_id)
+            return await self.fetch(queries.GET_ORDER_BY_CHARGE_ID, telegram_payment_charge_id)
+        self.on_items_changed(*item_ids)
+        return sold_items
 
     async def update_item_first_photo_from_items(self, item_id, value):
         sql = 'UPDATE items SET item_photos[1] = $1 WHERE item_id=$2'
         await self.execute(sql, value, item_id, execute=True)
+        self.on_items_changed(item_id)
 
     async def del_item_from_items(self, item_id: int):
         sql = """DELETE FROM items WHERE item_id=$1"""
         await self.execute(sql, item_id, execute=True)
+        self.on_items_changed(item_id)
 
     @staticmethod
     def format_args_for_deleting_items(parameters: dict):
@@ -251,6 +474,7 @@ class Database:
     async def delete_items_from_items(self, **kwargs):
         sql, parameters = self.format_args_for_deleting_items(kwargs)
         deleted_items = await self.execute(sql, *parameters, fetch=True)
+        self.on_items_changed()
         return len(deleted_items)
 
     @staticmethod
@@ -263,67 +487,59 @@ class Database:
     async def update_items_from_items(self, target: str, new_value, **kwargs):
         sql, parameters = self.format_args_for_updating_items(target, kwargs)
         updated_items = await self.execute(sql, new_value, *parameters, fetch=True)
+        self.on_items_changed()
         return len(updated_items)
 
-    async def create_table_basket(self):
-        sql = """CREATE TABLE IF NOT EXISTS basket (
-        telegram_id bigint NOT NULL,
-        item_id integer NOT NULL,
-        FOREIGN KEY (telegram_id) REFERENCES users(telegram_id),
-        FOREIGN KEY (item_id) REFERENCES items(item_id),
-        quantity smallint NOT NULL ,
-        added_at timestamp NOT NULL
-        )"""
-        await self.execute(sql, execute=True)
-
-    async def add_items_to_basket(self, telegram_id: int, item_id: int, quantity: int, added_at: datetime.datetime):
-        sql = 'INSERT INTO basket VALUES ($1, $2, $3, $4)'
-        await self.execute(sql, telegram_id, item_id, quantity, added_at, execute=True)
-        sql = """SELECT users.full_name, basket.item_id, items.item_name, basket.quantity, added_at FROM basket
-        JOIN users ON basket.telegram_id = users.telegram_id
-        JOIN items ON basket.item_id = items.item_id
-        WHERE basket.telegram_id=$1 AND basket.item_id=$2 AND added_at = (SELECT MAX(added_at) FROM basket)
-        """
-        return await self.execute(sql, telegram_id, item_id, fetchrow=True)
-
-    async def select_items_from_basket(self, telegram_id: int):
-        sql = """SELECT users.full_name, basket.item_id, items.item_name, basket.quantity, items.item_price, added_at 
-        FROM basket
-        JOIN users USING (telegram_id)
-        JOIN items USING (item_id)
-        WHERE telegram_id=$1
-        ORDER BY added_at
-        """
-        return await self.execute(sql, telegram_id, fetch=True)
-
-    async def delete_item_from_basket(self, telegram_id: int, item_id: int):
-        sql = """DELETE FROM basket WHERE telegram_id=$1 AND item_id=$2"""
-        await self.execute(sql, telegram_id, item_id, execute=True)
-
-    async def delete_all_items_from_basket(self, telegram_id: int):
-        sql = """DELETE FROM basket WHERE telegram_id=$1"""
-        await self.execute(sql, telegram_id, execute=True)
-
-    async def select_item_from_basket(self, telegram_id: int, item_id: int):
-        try:
-            sql = """SELECT users.full_name, basket.item_id, items.item_name, basket.quantity, items.item_price, 
-            added_at FROM basket
-            JOIN users ON basket.telegram_id = users.telegram_id
-            JOIN items ON basket.item_id = items.item_id
-            WHERE basket.telegram_id=$1 AND basket.item_id=$2
-            """
-            return await self.execute(sql, telegram_id, item_id, fetchrow=True)
-        except UnboundLocalError:
-            return None
-
-    async def change_quantity_item_in_basket(self, telegram_id: int, item_id: int, new_quantity: int,
-                                             new_added_at: datetime.datetime):
-        sql = """UPDATE basket SET quantity=$3, added_at=$4 WHERE telegram_id=$1 AND item_id=$2"""
-        await self.execute(sql, telegram_id, item_id, new_quantity, new_added_at, execute=True)
-        sql = """SELECT users.full_name, basket.item_id, items.item_name, basket.quantity, items.item_price, added_at 
-        FROM basket
-        JOIN users ON basket.telegram_id = users.telegram_id
-        JOIN items ON basket.item_id = items.item_id
-        WHERE basket.telegram_id=$1 AND basket.item_id=$2 AND added_at = (SELECT MAX(added_at) FROM basket)
-        """
-        return await self.execute(sql, telegram_id, item_id, fetchrow=True)
+    async def add_item_to_basket(self, telegram_id: int, item_id: int, quantity: int, added_at: datetime.datetime,
+                                 max_lines: int, max_payload_length: int) -> Optional[BasketLine]:
+        """Adds the item to the basket or increases its quantity there, see BasketStorage.add_item()"""
+        result = await self.basket_storage.add_item(telegram_id, item_id, quantity, added_at, max_lines,
+                                                    max_payload_length)
+        if result and result.get('quantity'):
+            self.on_basket_changed(telegram_id)
+        return result
+
+    async def select_items_from_basket(self, telegram_id: int) -> List[BasketLine]:
+        return await self.basket_storage.select_items(telegram_id)
+
+    async def count_items_in_basket(self, telegram_id: int) -> int:
+        if self.basket_storage.expires_by_itself:
+            # такое хранилище удаляет корзину по истечении срока без уведомления, поэтому закэшированное количество
+            # могло бы пережить корзину; подсчет в нем стоит один запрос без обращения к Postgres
+            return await self.basket_storage.count_items(telegram_id)
+        count = self.basket_counts.get(telegram_id)
+        if count is not None:
+            return count
+        basket_version = self.basket_version
+        count = await self.basket_storage.count_items(telegram_id)
+        # количество не кешируется, если корзину изменили, пока шел запрос
+        if basket_version == self.basket_version:
+            self.basket_counts.set(telegram_id, count)
+        return count
+
+    async def delete_item_from_basket(self, telegram_id: int, item_id: int) -> bool:
+        deleted = await self.basket_storage.delete_item(telegram_id, item_id)
+        self.on_basket_changed(telegram_id)
+        return deleted
+
+    async def delete_all_items_from_basket(self, telegram_id: int) -> bool:
+        deleted = await self.basket_storage.delete_all_items(telegram_id)
+        self.on_basket_changed(telegram_id)
+        return deleted
+
+    async def reconcile_basket(self, telegram_id: int, changed_at: datetime.datetime) -> List[BasketLine]:
+        basket = await self.basket_storage.reconcile(telegram_id, changed_at)
+        if any(line.get('deleted') or line.get('updated') for line in basket):
+            self.on_basket_changed(telegram_id)
+        return basket
+
+    async def delete_expired_baskets(self, expired_before: datetime.datetime) -> int:
+        started_at = time.monotonic()
+        telegram_ids = await self.basket_storage.delete_expired(expired_before)
+        purged_baskets = set(telegram_ids)
+        for telegram_id in purged_baskets:
+            self.on_basket_changed(telegram_id)
+        self.basket_sweeper_metrics.on_run(len(telegram_ids), len(purged_baskets), time.monotonic() - started_at)
+        if telegram_ids:
+            logger.info('%s expired baskets (%s rows) have been deleted', len(purged_baskets), len(telegram_ids))
+        return len(telegram_ids)
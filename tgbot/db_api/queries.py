@@ -0,0 +1,169 @@
+from typing import NamedTuple
+
+
+class Query(NamedTuple):
+    name: str
+    sql: str
+
+
+GET_USER = Query('get_user', 'SELECT * FROM users WHERE telegram_id=$1')
+
+GET_ITEM = Query('get_item', 'SELECT * FROM items WHERE item_id=$1')
+
+GET_ITEMS_BY_IDS = Query('get_items_by_ids', 'SELECT * FROM items WHERE item_id=ANY($1::int[])')
+
+GET_CATALOG = Query('get_catalog', """SELECT item_id, item_name, item_category_name, item_category_code,
+item_subcategory_name, item_subcategory_code,
+ROW_NUMBER() OVER (PARTITION BY item_category_code ORDER BY item_name) AS position
+FROM items WHERE item_discontinued=FALSE AND item_total_quantity>0
+ORDER BY item_category_name, item_subcategory_name, item_name""")
+
+SELECT_ITEMS_FROM_BASKET = Query('select_items_from_basket', """SELECT users.full_name, basket.item_id,
+items.item_name, basket.quantity, items.item_price, added_at
+FROM basket
+JOIN users USING (telegram_id)
+JOIN items USING (item_id)
+WHERE telegram_id=$1
+ORDER BY added_at""")
+
+# $1 - telegram_id. Блокирует добавление в корзину пользователя до конца транзакции, не мешая проверкам внешних
+# ключей (FOR KEY SHARE) при изменении строк корзины
+LOCK_USER_BASKET = Query('lock_user_basket', 'SELECT 1 FROM users WHERE telegram_id=$1 FOR NO KEY UPDATE')
+
+COUNT_ITEMS_IN_BASKET = Query('count_items_in_basket', 'SELECT COUNT(*) FROM basket WHERE telegram_id=$1')
+
+# $1 - telegram_id, $2 - item_id, $3 - количество, $4 - время добавления, $5 - максимум строк в корзине,
+# $6 - максимальная длина payload корзины ("item_id:quantity:...b").
+# Остаток на складе проверяется в ON CONFLICT ... WHERE по заблокированной строке корзины, поэтому одновременные
+# нажатия не могут положить в корзину больше, чем есть на складе.
+# Лимиты корзины проверяются по снимку на начало запроса, поэтому перед ним в той же транзакции берется
+# LOCK_USER_BASKET: иначе одновременное добавление разных товаров превысило бы лимит строк.
+# Если товар не добавлен, quantity и added_at равны NULL, а quantity_in_basket - текущее количество в корзине.
+ADD_ITEM_TO_BASKET = Query('add_item_to_basket', """WITH item AS (
+    SELECT item_id, item_name, item_price, item_total_quantity FROM items WHERE item_id=$2
+), basket_lines AS (
+    SELECT COUNT(*) AS lines_count,
+    COALESCE(SUM(LENGTH(item_id::text) + LENGTH(quantity::text) + 2), 0) + 1 AS payload_length
+    FROM basket WHERE telegram_id=$1
+), upserted AS (
+    INSERT INTO basket (telegram_id, item_id, quantity, added_at)
+    SELECT $1, item.item_id, $3, $4 FROM item, basket_lines
+    WHERE $3 <= item.item_total_quantity AND basket_lines.lines_count <= $5 AND basket_lines.payload_length <= $6
+    ON CONFLICT (telegram_id, item_id) DO UPDATE
+    SET quantity=basket.quantity + EXCLUDED.quantity, added_at=EXCLUDED.added_at
+    WHERE basket.quantity + EXCLUDED.quantity <= (SELECT item_total_quantity FROM item)
+    RETURNING quantity, added_at
+)
+SELECT (SELECT full_name FROM users WHERE telegram_id=$1) AS full_name, item.item_id, item.item_name,
+item.item_price, item.item_total_quantity, upserted.quantity, upserted.added_at,
+(SELECT quantity FROM basket WHERE telegram_id=$1 AND item_id=$2) AS quantity_in_basket,
+NOT (basket_lines.lines_count <= $5 AND basket_lines.payload_length <= $6) AS basket_is_full
+FROM item CROSS JOIN basket_lines LEFT JOIN upserted ON TRUE""")
+
+# сверяет корзину с остатками на складе: $1 - telegram_id, $2 - время изменения строк.
+# Недоступные товары удаляются из корзины (deleted), количество больше остатка уменьшается до остатка (updated)
+RECONCILE_BASKET = Query('reconcile_basket', """WITH lines AS (
+    SELECT basket.telegram_id, basket.item_id, basket.quantity, basket.added_at, items.item_name, items.item_price,
+    items.item_total_quantity, items.item_discontinued OR items.item_total_quantity<=0 AS unavailable
+    FROM basket JOIN items USING (item_id) WHERE basket.telegram_id=$1
+), deleted AS (
+    DELETE FROM basket USING lines
+    WHERE basket.telegram_id=$1 AND basket.item_id=lines.item_id AND lines.unavailable
+    RETURNING basket.item_id
+), updated AS (
+    UPDATE basket SET quantity=lines.item_total_quantity, added_at=$2 FROM lines
+    WHERE basket.telegram_id=$1 AND basket.item_id=lines.item_id AND NOT lines.unavailable
+    AND basket.quantity>lines.item_total_quantity
+    RETURNING basket.item_id, basket.quantity, basket.added_at
+)
+SELECT users.full_name, lines.item_id, lines.item_name, COALESCE(updated.quantity, lines.quantity) AS quantity,
+lines.item_price, COALESCE(updated.added_at, lines.added_at) AS added_at,
+deleted.item_id IS NOT NULL AS deleted, updated.item_id IS NOT NULL AS updated
+FROM lines
+JOIN users USING (telegram_id)
+LEFT JOIN deleted USING (item_id)
+LEFT JOIN updated USING (item_id)
+ORDER BY lines.added_at""")
+
+# удаляет корзины целиком, если в них ничего не добавляли с $1; возвращает по строке на каждую удаленную строку корзины
+DELETE_EXPIRED_BASKETS = Query('delete_expired_baskets', """DELETE FROM basket WHERE telegram_id IN (
+    SELECT telegram_id FROM basket WHERE added_at<$1
+    EXCEPT
+    SELECT telegram_id FROM basket WHERE added_at>=$1
+) RETURNING telegram_id""")
+
+# списывает со склада оплаченные товары: $1 - массив item_id, $2 - массив количеств.
+# Условие item_total_quantity>=quantity перепроверяется по последней версии строки, поэтому при одновременных оплатах
+# остаток не уходит в минус; товары, которых не хватило, не списываются и возвращаются с out_of_stock
+SOLD_ITEMS_CTE = """ordered AS (
+    SELECT item_id, SUM(quantity)::int AS quantity, MIN(position) AS position
+    FROM unnest($1::int[], $2::int[]) WITH ORDINALITY AS ordered(item_id, quantity, position)
+    GROUP BY item_id
+), updated AS (
+    UPDATE items SET item_total_quantity=items.item_total_quantity - ordered.quantity
+    FROM ordered
+    WHERE items.item_id=ordered.item_id AND items.item_total_quantity>=ordered.quantity
+    RETURNING items.item_id, items.item_total_quantity
+), sold AS (
+    SELECT items.item_id, items.item_name, items.item_price, ordered.quantity,
+    COALESCE(updated.item_total_quantity, items.item_total_quantity) AS item_total_quantity,
+    updated.item_id IS NULL AS out_of_stock, ordered.position
+    FROM ordered
+    JOIN items USING (item_id)
+    LEFT JOIN updated USING (item_id)
+)"""
+
+# списывает товары и записывает заказ с его строками одним запросом (то есть в одной транзакции):
+# $1, $2 - как в SOLD_ITEMS_CTE, $3...$14 - поля таблицы orders.
+# Если заказ с этим telegram_payment_charge_id уже записан, запрос падает на уникальном индексе
+# и откатывается целиком, вместе со списанием товаров
+CREATE_ORDER = Query('create_order', f"""WITH {SOLD_ITEMS_CTE}, new_order AS (
+    INSERT INTO orders (telegram_id, created_at, from_basket, total_amount, currency, shipping_option_id,
+    customer_name, phone_number, email, shipping_address, telegram_payment_charge_id, provider_payment_charge_id)
+    VALUES ($3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14)
+    RETURNING order_id
+), new_order_lines AS (
+    INSERT INTO order_lines (order_id, item_id, item_name, item_price, quantity, out_of_stock)
+    SELECT new_order.order_id, sold.item_id, sold.item_name, sold.item_price, sold.quantity, sold.out_of_stock
+    FROM new_order CROSS JOIN sold
+)
+SELECT new_order.order_id, sold.* FROM new_order CROSS JOIN sold ORDER BY sold.position""")
+
+# заказ, уже записанный по этой оплате, в том же виде, что возвращает CREATE_ORDER
+GET_ORDER_BY_CHARGE_ID = Query('get_order_by_charge_id', """SELECT orders.order_id, order_lines.item_id,
+order_lines.item_name, order_lines.item_price, order_lines.quantity, items.item_total_quantity,
+order_lines.out_of_stock
+FROM orders
+JOIN order_lines USING (order_id)
+LEFT JOIN items USING (item_id)
+WHERE orders.telegram_payment_charge_id=$1
+ORDER BY order_lines.item_id""")
+
+# товары корзины, которая хранится не в Postgres: $1 - telegram_id, $2 - массив item_id
+GET_BASKET_ITEMS = Query('get_basket_items', """SELECT users.full_name, items.item_id, items.item_name,
+items.item_price, items.item_total_quantity, items.item_discontinued FROM items
+LEFT JOIN users ON users.telegram_id=$1
+WHERE items.item_id=ANY($2::int[])""")
+
+SELECT_VISIBLE_ITEMS_PAGE = Query('select_visible_items_page', """SELECT * FROM items
+WHERE item_discontinued=FALSE AND item_total_quantity>0
+ORDER BY item_name LIMIT $1 OFFSET $2""")
+
+# $1 - категория, $2 - подкатегория или NULL, $3 и $4 - название и id текущего товара.
+# Следующий товар в порядке названий, после последнего - первый; items_quantity - сколько товаров в категории
+_NEXT_VISIBLE_ITEM = """SELECT item_id, COUNT(*) OVER () AS items_quantity FROM items
+WHERE item_category_code=$1 AND ($2::int IS NULL OR item_subcategory_code=$2)
+AND item_discontinued=FALSE AND item_total_quantity>0
+ORDER BY {order} LIMIT 1"""
+
+NEXT_VISIBLE_ITEM = Query('next_visible_item', _NEXT_VISIBLE_ITEM.format(
+    order='(item_name, item_id) > ($3, $4) DESC, item_name, item_id'))
+
+PREVIOUS_VISIBLE_ITEM = Query('previous_visible_item', _NEXT_VISIBLE_ITEM.format(
+    order='(item_name, item_id) < ($3, $4) DESC, item_name DESC, item_id DESC'))
+
+# $1 - текст запроса, $2 - шаблон для поиска по подстроке, $3 - шаблон для поиска по началу названия
+SEARCH_VISIBLE_ITEMS_PAGE = Query('search_visible_items_page', """SELECT * FROM items
+WHERE item_discontinued=FALSE AND item_total_quantity>0 AND (item_name ILIKE $2 OR item_name % $1)
+ORDER BY item_name ILIKE $3 DESC, similarity(item_name, $1) DESC, item_name
+LIMIT $4 OFFSET $5""")
@@ -39,6 +39,36 @@ async def get_photo_id(message: Message, state: FSMContext):
     await message_with_photo.reply(photo_id, reply_markup=ReplyKeyboardRemove())
 
 
+async def show_db_stats(message: Message, state: FSMContext):
+    await state.finish()
+    db = get_db(message)
+    stats = db.get_pool_stats()
+    sweeper = db.basket_sweeper_metrics
+    last_run_at = f'{sweeper.last_run_at:%d.%m.%Y %H:%M:%S} UTC' if sweeper.last_run_at else 'не запускалась'
+    albums = message.bot.get('album_metrics')
+    await message.answer(f'<b>Пул соединений с базой данных</b>\n\n'
+                         f'Соединений открыто: {stats.size} (min {stats.min_size}, max {stats.max_size})\n'
+                         f'Свободно: {stats.idle_size}\n'
+                         f'Занято сейчас: {stats.acquired}, максимум: {stats.max_acquired}\n'
+                         f'Ожидают соединения: {stats.waiting}\n'
+                         f'Всего выдано соединений: {stats.acquires_total}\n'
+                         f'Ожидание соединения: среднее {stats.wait_time_avg * 1000:.2f} мс, '
+                         f'максимальное {stats.wait_time_max * 1000:.2f} мс\n\n'
+                         f'<b>Очистка просроченных корзин</b>\n\n'
+                         f'Последний запуск: {last_run_at}, {sweeper.last_duration * 1000:.2f} мс\n'
+                         f'Удалено в последний раз: {sweeper.last_purged_baskets} корзин, '
+                         f'{sweeper.last_purged_rows} строк\n'
+                         f'Всего запусков: {sweeper.runs}, удалено {sweeper.purged_baskets_total} корзин, '
+                         f'{sweeper.purged_rows_total} строк\n\n'
+                         f'<b>Альбомы</b>\n\n'
+                         f'Собрано: {albums.albums_total}, сообщений в них: {albums.messages_total}\n'
+                         f'Сбор альбома: средний {albums.latency_avg * 1000:.0f} мс, '
+                         f'максимальный {albums.latency_max * 1000:.0f} мс\n'
+                         f'Собрано по максимальному ожиданию: {albums.capped_total}\n'
+                         f'Сообщений, пришедших после сбора альбома: {albums.split_total}',
+                         reply_markup=ReplyKeyboardRemove())
+
+
 async def show_admins_menu(message: Message, state: FSMContext):
     await state.finish()
     await message.answer(f'Для вас доступно меню администраторов.\n'
@@ -139,4 +169,5 @@ def register_admin_main(dp: Dispatcher):
                                        DeleteItemSubCategory, ChangeItemSubCategoryName],
                                 is_admin=True)
     dp.register_message_handler(show_admins_menu, Command('admins_menu'), state='*', is_admin=True)
+    dp.register_message_handler(show_db_stats, Command('db_stats'), state='*', is_admin=True)
     dp.register_message_handler(choose_admin_action, state=AdminActions, **admin_filters)
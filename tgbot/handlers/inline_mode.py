@@ -1,3 +1,5 @@
+import typing
+
 from aiogram import Dispatcher
 from aiogram.dispatcher.filters import CommandStart
 from aiogram.types import InlineQuery, InlineQueryResultArticle, InputTextMessageContent, InlineKeyboardMarkup, \
@@ -5,27 +7,42 @@ from aiogram.types import InlineQuery, InlineQueryResultArticle, InputTextMessag
 from aiogram.utils.callback_data import CallbackData
 from aiogram.utils.deep_linking import get_start_link
 
-from tgbot.handlers.user import select_or_add_user_from_or_to_database
+from tgbot.handlers.user import select_or_add_user_from_or_to_database, get_item
 from tgbot.keyboards.menu_keyboards.users_keyboards.menu_inline import item_keyboard, make_callback_data
+from tgbot.misc.cache import TTLCache
 from tgbot.misc.secondary_functions import get_db, get_item_data
 from tgbot.misc.texts import UserTexts
 
-show_item_from_inline_cd = CallbackData('show_from_inline', 'item_id', 'telegram_id')
+show_item_from_inline_cd = CallbackData('show_from_inline', 'item_id')
+
+INLINE_PAGE_SIZE = 50
+INLINE_CACHE_TIME = 60
+
+# результаты не зависят от пользователя и кешируются по версии товаров, тексту запроса и смещению
+inline_results_cache = TTLCache(maxsize=512, ttl=300)
+
+
+def normalize_inline_query(text: str) -> str:
+    return ' '.join(text.split()).lower()
 
 
-async def prepare_inline_query_answer(query: InlineQuery):
+async def prepare_inline_query_answer(query: InlineQuery, query_offset: int) -> \
+        typing.Tuple[typing.List[InlineQueryResultArticle], str]:
     db = get_db(query)
-    telegram_id = query.from_user.id
-    name_starts_with = str(query.query)
-    items = await db.select_items_like(name_starts_with)
+    text = normalize_inline_query(str(query.query))
+    cache_key = (db.items_version, text, query_offset)
+    cached_answer = inline_results_cache.get(cache_key)
+    if cached_answer:
+        return cached_answer
+    items = await db.select_items_like(text, limit=INLINE_PAGE_SIZE + 1, offset=query_offset)
+    next_offset = str(query_offset + INLINE_PAGE_SIZE) if len(items) > INLINE_PAGE_SIZE else ''
     results = []
-    for item in items:
+    for item in items[:INLINE_PAGE_SIZE]:
         item = get_item_data(item)
         markup = InlineKeyboardMarkup(inline_keyboard=[
             [
                 InlineKeyboardButton(text=f'Посмотреть в каталоге "{item.item_name}"',
-                                     callback_data=show_item_from_inline_cd.new(item_id=item.item_id,
-                                                                                telegram_id=telegram_id))
+                                     callback_data=show_item_from_inline_cd.new(item_id=item.item_id))
             ]
         ])
         description = item.item_short_description if item.item_short_description else item.item_description
@@ -40,19 +57,15 @@ async def prepare_inline_query_answer(query: InlineQuery):
                 message_text=f'Цена: {item.item_price}\n' + item.item_description
             ))
         results.append(result)
-    return results
+    inline_results_cache.set(cache_key, (results, next_offset))
+    return results, next_offset
 
 
 async def show_all_goods(query: InlineQuery):
     if query.chat_type == 'sender':
         query_offset = int(query.offset) if query.offset else 0
-        results = await prepare_inline_query_answer(query)
-        len_results = len(results)
-        if len_results <= 50:
-            await query.answer(results=results[query_offset:50], cache_time=5, next_offset='')
-        else:
-            await query.answer(results=results[query_offset:(query_offset+50)], cache_time=5,
-                               next_offset=str(query_offset+50))
+        results, next_offset = await prepare_inline_query_answer(query, query_offset)
+        await query.answer(results=results, cache_time=INLINE_CACHE_TIME, next_offset=next_offset)
     else:
         deep_link = await get_start_link(payload=str(query.from_user.id), encode=True)
         message_text = f'Чтобы начать покупки, переходи по ссылке {deep_link} и жми внизу экрана "СТАРТ" либо "НАЧАТЬ"'
@@ -71,10 +84,8 @@ async def show_all_goods(query: InlineQuery):
 async def show_from_inline(call: CallbackQuery, callback_data: dict):
     await call.answer(cache_time=10)
     item_id = int(callback_data.get('item_id'))
-    telegram_id = int(callback_data.get('telegram_id'))
-    db = get_db(call)
-    item_record = await db.get_item_from_items(item_id)
-    item = get_item_data(item_record)
+    telegram_id = call.from_user.id
+    item = await get_item(call, item_id)
     markup = await item_keyboard(call, item, quantity=1)
     message = await call.bot.send_message(text='Вы перемещены в каталог', chat_id=telegram_id)
     await message.answer_photo(photo=item.item_photos[0], caption=UserTexts.item_text(item), reply_markup=markup)
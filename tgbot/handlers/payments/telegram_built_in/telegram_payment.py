@@ -1,28 +1,31 @@
 import datetime
 import logging
+import time
 import typing
 
 from aiogram import Dispatcher, types
 from aiogram.dispatcher.filters import ChatTypeFilter
 from aiogram.types import CallbackQuery, LabeledPrice, ShippingQuery, PreCheckoutQuery, ShippingAddress, Message
-from apscheduler.jobstores.base import JobLookupError
 
 from tgbot.handlers.payments.telegram_built_in.shipping_options import ShippingOptions
 from tgbot.handlers.user import get_item, prepare_markup_for_basket, on_show_basket
 from tgbot.keyboards.menu_keyboards.users_keyboards.menu_inline import buy_item, categories_keyboard
-from tgbot.misc.schedule import remove_clear_basket_job
-from tgbot.misc.secondary_functions import get_db, get_config, get_item_in_basket_data, Item, delete_message
+from tgbot.misc.secondary_functions import get_db, get_config, get_item_in_basket_data, Item, delete_message, \
+    get_item_data, SoldItem, get_sold_item_data
 from tgbot.misc.texts import UserTexts
 
 logger = logging.getLogger(__name__)
 
+# на ответ на pre_checkout_query Telegram дает 10 секунд, после этого времени ответа пишется предупреждение
+PRE_CHECKOUT_WARNING_TIME = 5.0
+
 
 async def is_item_changed(target: typing.Union[CallbackQuery, Item],
                           item_id: typing.Optional[int], item_quantity: int):
     if not target:
         return None, None, None
 
-    item = target if isinstance(target, Item) else await get_item(target, int(item_id))
+    item = target if isinstance(target, Item) else await get_item(target, int(item_id), fresh=True)
 
     if item.item_discontinued or item.item_total_quantity == 0:
         return item, True, None
@@ -50,7 +53,7 @@ async def prepare_data_for_item_invoice(call: CallbackQuery, callback_data: dict
     prices = []
     item_id = callback_data.get("item_id")
     quantity = callback_data.get('quantity')
-    item = await get_item(call, int(item_id))
+    item = await get_item(call, int(item_id), fresh=True)
     ok, (item, new_quantity) = await check_item(item, None, int(quantity))
     if ok and item and new_quantity:
         await call.answer(f'Максимально возможное количество товара: "{item.item_name}", доступное к покупке '
@@ -82,34 +85,28 @@ async def prepare_data_for_basket_invoice(call: CallbackQuery) -> typing.Tuple[b
     payload = str()
     description = f"Счет на ваш заказ:"
     db = get_db(call)
-    items_from_basket = await db.select_items_from_basket(call.from_user.id)
+    # одним запросом сверяет корзину с остатками: лишнее количество уменьшается, недоступные товары удаляются
+    basket = await db.reconcile_basket(call.from_user.id, datetime.datetime.utcnow())
     alert_text = str()
     updated_items_in_basket_list = list()
     deleted_items_in_basket_list = list()
-    for item in items_from_basket:
-        item_in_basket = get_item_in_basket_data(item)
-        ok, (item, new_quantity) = await check_item(call, item_in_basket.item_id, item_in_basket.quantity)
-        if ok and item and new_quantity:
-            alert_text += (f'Максимально возможное количество товара: "{item.item_name}", доступное к покупке '
-                           f'{new_quantity}. Количество товара в корзине изменено\n\n')
-            updated_item_in_basket_record = await db.change_quantity_item_in_basket(call.from_user.id,
-                                                                                    item_in_basket.item_id,
-                                                                                    new_quantity,
-                                                                                    datetime.datetime.utcnow())
-            updated_item_in_basket = get_item_in_basket_data(updated_item_in_basket_record)
-            updated_items_in_basket_list.append(updated_item_in_basket)
-        elif ok:
+    for line in basket:
+        item_in_basket = get_item_in_basket_data(line)
+        if line.get('deleted'):
+            alert_text += (f'Товар <b>"{item_in_basket.item_name}"</b> с <b>ID {item_in_basket.item_id}</b> больше '
+                           f'недоступен. Товар удален из корзины\n')
+            deleted_items_in_basket_list.append(item_in_basket)
+        elif line.get('updated'):
+            alert_text += (f'Максимально возможное количество товара: "{item_in_basket.item_name}", доступное к '
+                           f'покупке {item_in_basket.quantity}. Количество товара в корзине изменено\n\n')
+            updated_items_in_basket_list.append(item_in_basket)
+        else:
             lable = f'"{item_in_basket.item_name}" - {item_in_basket.quantity} шт.'
             amount = item_in_basket.quantity * item_in_basket.item_price * 100
             price = LabeledPrice(label=lable, amount=amount)
             prices.append(price)
             total_price += amount
             payload += f'{item_in_basket.item_id}:{item_in_basket.quantity}:'
-        else:
-            alert_text += (f'Товар <b>"{item_in_basket.item_name}"</b> с <b>ID {item_in_basket.item_id}</b> больше '
-                           f'недоступен. Товар удален из корзины\n')
-            await db.delete_item_from_basket(call.from_user.id, item_in_basket.item_id)
-            deleted_items_in_basket_list.append(item_in_basket)
     if not updated_items_in_basket_list and not deleted_items_in_basket_list:
         payload += 'b'
         total_price = total_price // 100
@@ -185,18 +182,30 @@ async def choose_shipping(query: ShippingQuery):
                                               error_message='Сюда не доставляем')
 
 
-async def prepare_data_for_pre_checkout_query(query: PreCheckoutQuery) -> typing.Tuple[bool, str, int]:
-    invoice_payload = query.invoice_payload
+def parse_invoice_payload(invoice_payload: str) -> typing.List[typing.Tuple[int, int]]:
     list_invoice_payload = invoice_payload.split(':')
+    return [(int(list_invoice_payload[index_item_id]), int(list_invoice_payload[index_item_id + 1]))
+            for index_item_id in range(0, len(list_invoice_payload) - 1, 2)]
+
+
+async def get_items_by_ids(obj: typing.Union[Message, PreCheckoutQuery], item_ids: typing.List[int]) -> \
+        typing.Dict[int, Item]:
+    db = get_db(obj)
+    items_records = await db.get_items_by_ids(item_ids)
+    return {item.item_id: item for item in map(get_item_data, items_records)}
+
+
+async def prepare_data_for_pre_checkout_query(query: PreCheckoutQuery) -> typing.Tuple[bool, str, int]:
+    ordered_items = parse_invoice_payload(query.invoice_payload)
     shipping_option_id = query.shipping_option_id
     total_amount_without_shipping = (query.total_amount // 100) - (ShippingOptions.price(shipping_option_id) // 100)
     text = str()
     ok = True
     new_total_amount = 0
-    for index_item_id in range(0, len(list_invoice_payload) - 1, 2):
-        item_id = int(list_invoice_payload[index_item_id])
-        quantity = int(list_invoice_payload[index_item_id + 1])
-        item = await get_item(query, item_id)
+    # все товары счета читаются одним запросом
+    items = await get_items_by_ids(query, [item_id for item_id, _ in ordered_items])
+    for item_id, quantity in ordered_items:
+        item = items.get(item_id)
         if item:
             amount = item.item_price * quantity
             new_total_amount += amount
@@ -221,15 +230,22 @@ async def prepare_data_for_pre_checkout_query(query: PreCheckoutQuery) -> typing
 
 
 async def process_pre_checkout_query(query: PreCheckoutQuery):
+    started_at = time.monotonic()
     ok, text, new_total_amount = await prepare_data_for_pre_checkout_query(query)
+    checked_at = time.monotonic()
     if ok:
         await query.bot.answer_pre_checkout_query(pre_checkout_query_id=query.id,
                                                   ok=True)
-        await query.bot.send_message(chat_id=query.from_user.id,
-                                     text=text)
     else:
         await query.bot.answer_pre_checkout_query(pre_checkout_query_id=query.id, ok=False,
                                                   error_message=text)
+    answered_at = time.monotonic()
+    log = logger.warning if answered_at - started_at >= PRE_CHECKOUT_WARNING_TIME else logger.info
+    log('Pre-checkout query %s has been answered in %.3f s (checking %.3f s, answer %.3f s), ok=%s',
+        query.id, answered_at - started_at, checked_at - started_at, answered_at - checked_at, ok)
+    if ok:
+        await query.bot.send_message(chat_id=query.from_user.id,
+                                     text=text)
 
 
 def get_shipping_addres(addres: ShippingAddress) -> str:
@@ -255,10 +271,14 @@ def get_customer_info(message: Message) -> typing.Tuple[str, str]:
     return customer_info, customer_email
 
 
-def order_info_for_admins(item: Item, number: int, quantity: int) -> str:
-    order_info = f'{number}. ID {item.item_id} {item.item_name} - {quantity} шт. ' \
-                 f'* {item.item_price} руб. = {item.item_price*quantity} руб.\nНа складе осталось: ' \
-                 f'{item.item_total_quantity - quantity} шт.\n\n'
+def order_info_for_admins(sold_item: SoldItem, number: int) -> str:
+    order_info = f'{number}. ID {sold_item.item_id} {sold_item.item_name} - {sold_item.quantity} шт. ' \
+                 f'* {sold_item.item_price} руб. = {sold_item.item_price*sold_item.quantity} руб.\n'
+    if sold_item.out_of_stock:
+        order_info += f'<b>Не хватило на складе, товар не списан!</b> На складе: ' \
+                      f'{sold_item.item_total_quantity} шт.\n\n'
+    else:
+        order_info += f'На складе осталось: {sold_item.item_total_quantity} шт.\n\n'
     return order_info
 
 
@@ -268,18 +288,31 @@ async def prepare_data_for_succesfull_payment(message: Message) -> typing.Tuple[
     number = 1
     total_for_goods = 0
     db = get_db(message)
-    list_invoice_payload = message.successful_payment.invoice_payload.split(':')
-    for index_item_id in range(0, len(list_invoice_payload) - 1, 2):
-        item_id = int(list_invoice_payload[index_item_id])
-        quantity = int(list_invoice_payload[index_item_id + 1])
-        item = await get_item(message, item_id)
-        new_quantity = item.item_total_quantity - quantity
-        text_for_admins += order_info_for_admins(item, number, quantity)
-        await db.update_item_from_items(item_id, 'item_total_quantity', new_quantity)
-        text_for_customer += f'{number}. <b>{item.item_name}</b> - {quantity} шт. Сумма: ' \
-                             f'{item.item_price*quantity} руб.\n\n'
+    successful_payment = message.successful_payment
+    order_info = successful_payment.order_info
+    ordered_items = parse_invoice_payload(successful_payment.invoice_payload)
+    # товары списываются со склада и заказ записывается одним запросом
+    sold_items_records = await db.create_order(
+        ordered_items, telegram_id=message.from_user.id, created_at=datetime.datetime.utcnow(),
+        from_basket=is_order_from_basket(message), total_amount=successful_payment.total_amount,
+        currency=successful_payment.currency, shipping_option_id=successful_payment.shipping_option_id,
+        customer_name=order_info.name, phone_number=order_info.phone_number, email=order_info.email,
+        shipping_address=get_shipping_addres(order_info.shipping_address),
+        telegram_payment_charge_id=successful_payment.telegram_payment_charge_id,
+        provider_payment_charge_id=successful_payment.provider_payment_charge_id)
+    sold_items = [get_sold_item_data(record) for record in sold_items_records]
+    if sold_items_records:
+        text_for_admins += f'<b>Заказ № {sold_items_records[0].get("order_id")}</b>\n\n'
+    for sold_item in sold_items:
+        text_for_admins += order_info_for_admins(sold_item, number)
+        text_for_customer += f'{number}. <b>{sold_item.item_name}</b> - {sold_item.quantity} шт. Сумма: ' \
+                             f'{sold_item.item_price*sold_item.quantity} руб.\n\n'
         number += 1
-        total_for_goods += item.item_price*quantity
+        total_for_goods += sold_item.item_price*sold_item.quantity
+    sold_items_ids = [sold_item.item_id for sold_item in sold_items]
+    for item_id, quantity in ordered_items:
+        if item_id not in sold_items_ids:
+            text_for_admins += f'<b>Товар с ID {item_id} - {quantity} шт. не найден, товар не списан!</b>\n\n'
     text_for_customer += f'<b>Итого за товары:</b> {total_for_goods} руб.'
     text_for_admins += f'<b>Итого за товары:</b> {total_for_goods} руб.'
     return text_for_customer, text_for_admins
@@ -297,10 +330,6 @@ async def succesfull_payment(message: Message):
     await db.update_user_email(customer_email, message.from_user.id)
     if is_order_from_basket(message):
         await db.delete_all_items_from_basket(message.chat.id)
-        try:
-            remove_clear_basket_job(message, message.chat.id)
-        except JobLookupError as err:
-            logger.exception(err)
     amount = message.successful_payment.total_amount // 100
     currency = message.successful_payment.currency
     shipping_prices_text, total_shipping_price = get_shipping_data(message.successful_payment.shipping_option_id)
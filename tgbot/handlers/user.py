@@ -9,15 +9,13 @@ from aiogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKe
     InputMediaPhoto, PreCheckoutQuery
 from aiogram.utils.deep_linking import get_start_link, decode_payload
 from aiogram.utils.exceptions import MessageNotModified, BotBlocked
-from apscheduler.jobstores.base import JobLookupError
 
 from tgbot.keyboards.inline import main_menu_keyboard, main_menu_cd
 from tgbot.keyboards.menu_keyboards.users_keyboards.menu_inline import categories_keyboard, subcategories_keyboard, \
-    items_keyboard, item_keyboard, menu_cd, edit_quantity_cd, scroll_items_cd, more_photos_cd, \
+    items_keyboard, item_keyboard, build_item_keyboard, menu_cd, edit_quantity_cd, scroll_items_cd, more_photos_cd, \
     back_button_keyboard_for_more_photos, add_to_basket_cd, basket_cd, edit_basket_markup
-from tgbot.misc.schedule import clear_basket_on_schedule, remove_clear_basket_job
 from tgbot.misc.secondary_functions import get_db, get_user_data, get_item_data, Item, ItemInBasket, \
-    get_item_in_basket_data, User, delete_message, load_basket_payload, check_payload, check_price_list
+    get_item_in_basket_data, User, delete_message, BASKET_MAX_LINES, BASKET_PAYLOAD_MAX_LENGTH
 from tgbot.misc.texts import UserTexts
 
 logger = logging.getLogger(__name__)
@@ -34,7 +32,7 @@ async def create_start_link(message: Message, state: FSMContext):
 async def get_referer(message: Message, decoded_args: typing.Optional[int]) -> typing.Union[User, None]:
     db = get_db(message)
     if decoded_args:
-        referer_record = await db.select_item_from_table('users', telegram_id=decoded_args)
+        referer_record = await db.select_user(decoded_args)
         if referer_record:
             referer = get_user_data(referer_record)
             return referer
@@ -58,7 +56,7 @@ async def select_or_add_user_from_or_to_database(message: Message, decoded_args:
     referer = await get_referer(message, decoded_args)
     db = get_db(message)
     new_user = False
-    user_record = await db.select_item_from_table('users', telegram_id=message.from_user.id)
+    user_record = await db.select_user(message.from_user.id)
     if not user_record:
         user_record = await db.add_new_user(telegram_id=message.from_user.id,
                                             username=message.from_user.username,
@@ -183,12 +181,20 @@ async def list_items(call: CallbackQuery, item_category_code: int, item_subcateg
                                             reply_markup=markup)
 
 
-async def get_item(obj: typing.Union[Message, CallbackQuery, PreCheckoutQuery], item_id: int) -> \
-        typing.Union[Item, None]:
+async def get_item(obj: typing.Union[Message, CallbackQuery, PreCheckoutQuery], item_id: int,
+                   fresh: bool = False) -> typing.Union[Item, None]:
     db = get_db(obj)
+    if not fresh:
+        item = db.items_cache.get(item_id)
+        if item:
+            return item
+    items_version = db.items_version
     item_record = await db.get_item_from_items(item_id)
     if item_record:
         item = get_item_data(item_record)
+        # товар не кешируется, если его изменили, пока шел запрос
+        if items_version == db.items_version:
+            db.items_cache.set(item_id, item)
         return item
     return
 
@@ -232,49 +238,45 @@ async def navigate(call: CallbackQuery, callback_data: dict):
             await show_item(call, item_id)
 
 
-async def get_data_for_edit_quantity(call: CallbackQuery, callback_data: dict) -> typing.Tuple[Item, int, int]:
+def get_data_for_edit_quantity(callback_data: dict) -> typing.Tuple[int, int, int, int, int, bool]:
     item_id = int(callback_data.get('item_id'))
     quantity = int(callback_data.get('quantity'))
-    item = await get_item(call, item_id)
-    return item, quantity, item_id
+    item_total_quantity = int(callback_data.get('item_total_quantity'))
+    item_category_code = int(callback_data.get('item_category_code'))
+    item_subcategory_code = int(callback_data.get('item_subcategory_code'))
+    in_basket = callback_data.get('in_basket') == '1'
+    return item_id, quantity, item_total_quantity, item_category_code, item_subcategory_code, in_basket
 
 
 async def increase_quantity(call: CallbackQuery, callback_data: dict):
-    item, quantity, item_id = await get_data_for_edit_quantity(call, callback_data)
-    if item:
-        if quantity < item.item_total_quantity:
-            await call.answer(cache_time=1)
-            quantity += 1
-        try:
-            markup = await item_keyboard(call, item, quantity)
-            await call.message.edit_reply_markup(reply_markup=markup)
-        except MessageNotModified:
-            await call.answer(text=f'{quantity} - это максимальное количество данного товара на складе',
-                              show_alert=True)
-    else:
-        if await delete_message(call, logger, UserTexts.PHOTO_LOGO, reboot_text=UserTexts.USER_REBOOT_BOT):
-            await call.message.answer_photo(UserTexts.PHOTO_LOGO,
-                                            UserTexts.user_products_out_of_stock_while_change(item_id),
-                                            reply_markup=await categories_keyboard(call))
+    # остаток берется из кнопки, актуальность проверяется при добавлении в корзину и при покупке
+    item_id, quantity, item_total_quantity, item_category_code, item_subcategory_code, in_basket = \
+        get_data_for_edit_quantity(callback_data)
+    if quantity < item_total_quantity:
+        await call.answer(cache_time=1)
+        quantity += 1
+    try:
+        markup = build_item_keyboard(call.from_user.id, item_id, item_category_code, item_subcategory_code,
+                                     item_total_quantity, quantity, in_basket)
+        await call.message.edit_reply_markup(reply_markup=markup)
+    except MessageNotModified:
+        await call.answer(text=f'{quantity} - это максимальное количество данного товара на складе',
+                          show_alert=True)
 
 
 async def decrease_quantity(call: CallbackQuery, callback_data: dict):
-    item, quantity, item_id = await get_data_for_edit_quantity(call, callback_data)
-    if item:
-        if quantity > 1:
-            await call.answer(cache_time=1)
-            quantity -= 1
-        try:
-            markup = await item_keyboard(call, item, quantity)
-            await call.message.edit_reply_markup(reply_markup=markup)
-        except MessageNotModified:
-            await call.answer(text=f'{quantity} - это минимально возможное количество данного товара для покупки',
-                              show_alert=True)
-    else:
-        if await delete_message(call, logger, UserTexts.PHOTO_LOGO, reboot_text=UserTexts.USER_REBOOT_BOT):
-            await call.message.answer_photo(UserTexts.PHOTO_LOGO,
-                                            UserTexts.user_products_out_of_stock_while_change(item_id),
-                                            reply_markup=await categories_keyboard(call))
+    item_id, quantity, item_total_quantity, item_category_code, item_subcategory_code, in_basket = \
+        get_data_for_edit_quantity(callback_data)
+    if quantity > 1:
+        await call.answer(cache_time=1)
+        quantity -= 1
+    try:
+        markup = build_item_keyboard(call.from_user.id, item_id, item_category_code, item_subcategory_code,
+                                     item_total_quantity, quantity, in_basket)
+        await call.message.edit_reply_markup(reply_markup=markup)
+    except MessageNotModified:
+        await call.answer(text=f'{quantity} - это минимально возможное количество данного товара для покупки',
+                          show_alert=True)
 
 
 def get_data_for_scroll_items(callback_data: dict) -> typing.Tuple[int, int, int]:
@@ -284,42 +286,25 @@ def get_data_for_scroll_items(callback_data: dict) -> typing.Tuple[int, int, int
     return item_id, item_category_code, item_subcategory_code
 
 
-def determine_next_item_id(scroll_direction: str, current_item_id: int, list_items_ids: typing.List[int]):
-    try:
-        current_item_id_index = list_items_ids.index(current_item_id)
-    except ValueError:
-        return list_items_ids[0]
-    else:
-        if scroll_direction == 'right':
-            next_item_id_index = current_item_id_index + 1 if current_item_id_index != len(list_items_ids) - 1 else 0
-            next_item_id = list_items_ids[next_item_id_index]
-            return next_item_id
-        elif scroll_direction == 'left':
-            next_item_id_index = current_item_id_index - 1 if current_item_id_index != 0 else len(list_items_ids) - 1
-            next_item_id = list_items_ids[next_item_id_index]
-            return next_item_id
-
-
 async def determine_next_item(call: CallbackQuery, item_id: int, item_category_code: int, item_subcategory_code,
                               scroll_direction: str) -> typing.Union[Item, None]:
     db = get_db(call)
-    items_records = await db.get_items_from_items(item_category_code, item_subcategory_code)
-    list_items_ids = [item_record.get('item_id') for item_record in items_records]
-    if list_items_ids:
-        if len(list_items_ids) == 1 and list_items_ids[0] == item_id:
-            await call.answer(text='В этой категории только один товар. Листать некуда', show_alert=True)
-            return
-        elif len(list_items_ids) == 1:
-            await call.answer(cache_time=1)
-            item = get_item_data(items_records[0])
-            return item
-        else:
-            await call.answer(cache_time=1)
-            next_item_id = determine_next_item_id(scroll_direction=scroll_direction, current_item_id=item_id,
-                                                  list_items_ids=list_items_ids)
-            item = [get_item_data(item_record) for item_record in items_records if
-                    item_record.get('item_id') == next_item_id][0]
-            return item
+    catalog = await db.get_catalog()
+    next_item_id, items_quantity = catalog.next_item_id(item_category_code, item_subcategory_code, item_id,
+                                                        scroll_direction)
+    if not next_item_id:
+        # каталог мог быть построен до того, как товары появились в категории, поэтому проверяется таблица
+        current_item = await get_item(call, item_id)
+        next_item_id, items_quantity = await db.get_next_visible_item_id(
+            item_category_code, item_subcategory_code, current_item.item_name if current_item else '', item_id,
+            scroll_direction)
+    if items_quantity == 1 and next_item_id == item_id:
+        await call.answer(text='В этой категории только один товар. Листать некуда', show_alert=True)
+        return
+    item = await get_item(call, next_item_id) if next_item_id else None
+    if item:
+        await call.answer(cache_time=1)
+        return item
     else:
         if await delete_message(call, logger, UserTexts.PHOTO_LOGO, reboot_text=UserTexts.USER_REBOOT_BOT):
             await call.message.answer_photo(UserTexts.PHOTO_LOGO,
@@ -409,23 +394,11 @@ async def back_to_main_photo(call: CallbackQuery, callback_data, state: FSMConte
                                             reply_markup=await categories_keyboard(call))
 
 
-async def get_data_for_add_item_to_basket(call: CallbackQuery, callback_data: dict) -> typing.Tuple[Item, int, int,
-                                                                                                    int]:
+def get_data_for_add_item_to_basket(callback_data: dict) -> typing.Tuple[int, int, int]:
     telegram_id = int(callback_data.get('telegram_id'))
     item_id = int(callback_data.get('item_id'))
     quantity = int(callback_data.get('quantity'))
-    item = await get_item(call, item_id)
-    return item, telegram_id, quantity, item_id
-
-
-async def get_item_in_basket(obj: typing.Union[Message, CallbackQuery], telegram_id: int, item_id: int) -> \
-        typing.Union[ItemInBasket, None]:
-    db = get_db(obj)
-    item_in_basket_record = await db.select_item_from_basket(telegram_id, item_id)
-    if item_in_basket_record:
-        item_in_basket = get_item_in_basket_data(item_in_basket_record)
-        return item_in_basket
-    return
+    return telegram_id, quantity, item_id
 
 
 async def action_if_not_excceeded_total_quantity(call: CallbackQuery, new_item_in_basket: ItemInBasket, quantity: int):
@@ -436,38 +409,28 @@ async def action_if_not_excceeded_total_quantity(call: CallbackQuery, new_item_i
         await call.message.answer(adding_to_basket_text)
         markup = await categories_keyboard(call)
         await call.message.answer_photo(UserTexts.PHOTO_LOGO, UserTexts.USER_BACK_TO_CATALOG, reply_markup=markup)
-        clear_basket_on_schedule(call, added_at=new_item_in_basket.added_at)
 
 
 async def add_item_to_basket(call: CallbackQuery, callback_data: dict):
-    item, telegram_id, quantity, item_id = await get_data_for_add_item_to_basket(call, callback_data)
-    if item:
-        db = get_db(call)
-        items_from_basket = await db.select_items_from_basket(call.from_user.id)
-        payload = await load_basket_payload(items_from_basket)
-        if check_payload(payload) and check_price_list(list(items_from_basket)):
-            added_at = datetime.datetime.utcnow()
-            item_in_basket = await get_item_in_basket(call, telegram_id, item.item_id)
-            if item_in_basket:
-                new_quantity = quantity + item_in_basket.quantity
-                if new_quantity <= item.item_total_quantity:
-                    new_item_in_basket_record = await db.change_quantity_item_in_basket(telegram_id, item.item_id,
-                                                                                        new_quantity, added_at)
-                    new_item_in_basket = get_item_in_basket_data(new_item_in_basket_record)
-                    await action_if_not_excceeded_total_quantity(call, new_item_in_basket, quantity)
-                else:
-                    await call.answer(UserTexts.user_unsuccessful_adding_to_basket(
-                        item_in_basket, quantity, item.item_total_quantity),
-                        show_alert=True)
-            else:
-                new_item_in_basket_record = await db.add_items_to_basket(telegram_id, item.item_id,
-                                                                         quantity, added_at)
-                new_item_in_basket = get_item_in_basket_data(new_item_in_basket_record)
-                await action_if_not_excceeded_total_quantity(call, new_item_in_basket, quantity)
-        else:
+    telegram_id, quantity, item_id = get_data_for_add_item_to_basket(callback_data)
+    db = get_db(call)
+    added_at = datetime.datetime.utcnow()
+    result = await db.add_item_to_basket(telegram_id, item_id, quantity, added_at,
+                                         max_lines=BASKET_MAX_LINES, max_payload_length=BASKET_PAYLOAD_MAX_LENGTH)
+    if result:
+        if result.get('quantity'):
+            new_item_in_basket = get_item_in_basket_data(result)
+            await action_if_not_excceeded_total_quantity(call, new_item_in_basket, quantity)
+        elif result.get('basket_is_full'):
             await call.answer('Это максимальное количество товаров в корзине. Больше нельзя добавить товары. Вы '
                               'можете оплатить текущую "корзину" и вернуться к покупкам',
                               show_alert=True)
+        else:
+            item_in_basket = ItemInBasket(result.get('full_name'), item_id, result.get('item_name'),
+                                          result.get('quantity_in_basket') or 0, result.get('item_price'), added_at)
+            await call.answer(UserTexts.user_unsuccessful_adding_to_basket(
+                item_in_basket, quantity, result.get('item_total_quantity')),
+                show_alert=True)
     else:
         if await delete_message(call, logger, UserTexts.PHOTO_LOGO, reboot_text=UserTexts.USER_REBOOT_BOT):
             await call.message.answer_photo(UserTexts.PHOTO_LOGO,
@@ -523,7 +486,7 @@ async def delete_item_from_basket(call: CallbackQuery, callback_data: dict):
     await call.answer(cache_time=1)
     db = get_db(call)
     item_id = int(callback_data.get('item_id'))
-    await db.delete_item_from_basket(call.from_user.id, item_id)
+    deleted = await db.delete_item_from_basket(call.from_user.id, item_id)
     text, basket_list_items = await prepare_markup_for_basket(call)
     markup = edit_basket_markup(basket_list_items)
     if basket_list_items:
@@ -533,12 +496,12 @@ async def delete_item_from_basket(call: CallbackQuery, callback_data: dict):
         markup = await categories_keyboard(call)
         # await call.message.delete()
         if await delete_message(call, logger, UserTexts.PHOTO_LOGO, UserTexts.USER_REBOOT_BOT):
-            try:
-                remove_clear_basket_job(call)
+            if deleted:
                 text = UserTexts.user_basket_deleted_item(item_id) + ' ' + UserTexts.USER_BASKET_EMPTY
                 await call.message.answer_photo(UserTexts.PHOTO_LOGO, caption=text, reply_markup=markup)
                 # await call.message.edit_text(text, reply_markup=markup)
-            except JobLookupError:
+            else:
+                # корзину уже удалили по истечении срока
                 text = UserTexts.USER_BASKET_CANCEL_AFTER_24_HOURS
                 await call.message.answer_photo(UserTexts.PHOTO_LOGO, caption=text, reply_markup=markup)
 
@@ -560,15 +523,14 @@ async def cancel_basket(call: CallbackQuery):
 async def clear_basket(call: CallbackQuery):
     await call.answer(cache_time=1)
     db = get_db(call)
-    await db.delete_all_items_from_basket(call.from_user.id)
+    deleted = await db.delete_all_items_from_basket(call.from_user.id)
     markup = await categories_keyboard(call)
     # await call.message.delete()
     if await delete_message(call, logger, UserTexts.PHOTO_LOGO, UserTexts.USER_REBOOT_BOT):
-        try:
-            remove_clear_basket_job(call)
+        if deleted:
             await call.message.answer_photo(UserTexts.PHOTO_LOGO, caption=UserTexts.USER_BASKET_CANCEL_WITHOUT_GOODS,
                                             reply_markup=markup)
-        except JobLookupError:
+        else:
             await call.message.answer_photo(UserTexts.PHOTO_LOGO, caption=UserTexts.USER_BASKET_CANCEL_AFTER_24_HOURS,
                                             reply_markup=markup)
 
@@ -3,14 +3,15 @@ import typing
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message, CallbackQuery
 from aiogram.utils.callback_data import CallbackData
 
-from tgbot.db_api.postgres_db import Database
 from tgbot.keyboards.inline import main_menu_cd
-from tgbot.misc.secondary_functions import get_db, Item, get_item_data
+from tgbot.misc.secondary_functions import get_db, Item
 
 menu_cd = CallbackData('show_menu', 'level', 'item_category_code', 'item_subcategory_code', 'item_id')
 buy_item = CallbackData('buy', 'item_id', 'quantity')
 scroll_items_cd = CallbackData('scroll', 'towards', 'item_id', 'item_category_code', 'item_subcategory_code')
-edit_quantity_cd = CallbackData('edit_quantity', 'increase_or_decrease', 'item_id', 'quantity')
+# остаток на складе, категория и наличие корзины передаются в кнопке, чтобы ⬆/⬇ не обращались к базе
+edit_quantity_cd = CallbackData('edit_quantity', 'increase_or_decrease', 'item_id', 'quantity', 'item_total_quantity',
+                                'item_category_code', 'item_subcategory_code', 'in_basket')
 add_to_basket_cd = CallbackData('add_to_basket', 'telegram_id', 'item_id', 'quantity')
 basket_cd = CallbackData('basket', 'action', 'item_id')
 more_photos_cd = CallbackData('more_photos', 'action', 'item_id')
@@ -31,9 +32,13 @@ def make_scroll_items_cd(towards: str, item_id: int, item_category_code: int,
                                item_subcategory_code=item_subcategory_code)
 
 
-async def exist_subcategories(db: Database, item_category_code: int) -> bool:
-    item_subcategory_names_list = [(list(i)[0]) for i in await db.get_subcategories_from_items(item_category_code)]
-    return any(item_subcategory_names_list)
+def make_edit_quantity_cd(increase_or_decrease: str, item_id: int, quantity: int, item_total_quantity: int,
+                          item_category_code: int, item_subcategory_code: typing.Optional[int], in_basket: bool):
+    if item_subcategory_code is None:
+        item_subcategory_code = 0
+    return edit_quantity_cd.new(increase_or_decrease=increase_or_decrease, item_id=item_id, quantity=quantity,
+                                item_total_quantity=item_total_quantity, item_category_code=item_category_code,
+                                item_subcategory_code=item_subcategory_code, in_basket=int(in_basket))
 
 
 async def categories_keyboard(obj: typing.Union[Message, CallbackQuery]):
@@ -42,16 +47,17 @@ async def categories_keyboard(obj: typing.Union[Message, CallbackQuery]):
     CURRENT_LEVEL = 0
 
     markup = InlineKeyboardMarkup(row_width=2)
-    item_categories = await db.get_categories_from_items()
+    catalog = await db.get_catalog()
+    item_categories = catalog.categories()
 
     if item_categories:
-        for item_category_record in item_categories:
-            item_category_name = dict(item_category_record).get('item_category_name')
-            item_category_code = dict(item_category_record).get('item_category_code')
-            # number_of_items = await db.count_items(item_category_code)
+        for item_category in item_categories:
+            item_category_name = item_category.item_category_name
+            item_category_code = item_category.item_category_code
+            # number_of_items = item_category.items_count
             button_text = f"{item_category_name}"
 
-            if await exist_subcategories(db, item_category_code):
+            if item_category.has_subcategories:
                 callback_data = make_callback_data(level=CURRENT_LEVEL+1,
                                                    item_category_code=item_category_code)
                 markup.insert(InlineKeyboardButton(text=button_text, callback_data=callback_data))
@@ -77,13 +83,13 @@ async def subcategories_keyboard(call: CallbackQuery, item_category_code: int):
     CURRENT_LEVEL = 1
 
     markup = InlineKeyboardMarkup(row_width=2)
-    item_subcategories = await db.get_subcategories_from_items(item_category_code)
+    catalog = await db.get_catalog()
+    item_subcategories = catalog.subcategories(item_category_code)
 
-    for item_subcategory_record in item_subcategories:
-        item_subcategory_name = dict(item_subcategory_record).get('item_subcategory_name')
-        item_subcategory_code = dict(item_subcategory_record).get('item_subcategory_code')
-        # number_of_items = await db.count_items(item_category_code=item_category_code,
-        #                                        item_subcategory_code=item_subcategory_code)
+    for item_subcategory in item_subcategories:
+        item_subcategory_name = item_subcategory.item_subcategory_name
+        item_subcategory_code = item_subcategory.item_subcategory_code
+        # number_of_items = len(item_subcategory.items)
         button_text = f"{item_subcategory_name}"
         callback_data = make_callback_data(level=CURRENT_LEVEL+1,
                                            item_category_code=item_category_code,
@@ -103,10 +109,10 @@ async def items_keyboard(call: CallbackQuery, item_category_code: int, item_subc
     CURRENT_LEVEL = 2
 
     markup = InlineKeyboardMarkup(row_width=2)
-    items = await db.get_items_from_items(item_category_code, item_subcategory_code)
+    catalog = await db.get_catalog()
+    items = catalog.items(item_category_code, item_subcategory_code)
 
-    for item_record in items:
-        item = get_item_data(item_record)
+    for item in items:
         button_text = f'{item.item_name}'
         callback_data = make_callback_data(level=CURRENT_LEVEL+1,
                                            item_category_code=item_category_code,
@@ -116,7 +122,7 @@ async def items_keyboard(call: CallbackQuery, item_category_code: int, item_subc
 
     await check_on_basket_button(call, markup)
 
-    if await exist_subcategories(db, item_category_code):
+    if catalog.has_subcategories(item_category_code):
         markup.row(InlineKeyboardButton(text='Назад',
                                         callback_data=make_callback_data(level=CURRENT_LEVEL - 1,
                                                                          item_category_code=item_category_code)))
@@ -127,6 +133,14 @@ async def items_keyboard(call: CallbackQuery, item_category_code: int, item_subc
 
 
 async def item_keyboard(call: CallbackQuery, item: Item, quantity: int):
+    in_basket = await has_basket(call)
+    return build_item_keyboard(call.from_user.id, item.item_id, item.item_category_code, item.item_subcategory_code,
+                               item.item_total_quantity, quantity, in_basket)
+
+
+def build_item_keyboard(telegram_id: int, item_id: int, item_category_code: int,
+                        item_subcategory_code: typing.Optional[int], item_total_quantity: int, quantity: int,
+                        in_basket: bool) -> InlineKeyboardMarkup:
 
     CURRENT_LEVEL = 3
 
@@ -135,68 +149,65 @@ async def item_keyboard(call: CallbackQuery, item: Item, quantity: int):
     markup.row(InlineKeyboardButton(text='Больше фото',
                                     callback_data=more_photos_cd.new(
                                         action='show',
-                                        item_id=item.item_id
+                                        item_id=item_id
                                     )))
 
     markup.row(InlineKeyboardButton(text='⬅',
                                     callback_data=make_scroll_items_cd(
                                         towards='left',
-                                        item_id=item.item_id,
-                                        item_category_code=item.item_category_code,
-                                        item_subcategory_code=item.item_subcategory_code)),
+                                        item_id=item_id,
+                                        item_category_code=item_category_code,
+                                        item_subcategory_code=item_subcategory_code)),
                InlineKeyboardButton(text='➡',
                                     callback_data=make_scroll_items_cd(
                                         towards='right',
-                                        item_id=item.item_id,
-                                        item_category_code=item.item_category_code,
-                                        item_subcategory_code=item.item_subcategory_code)))
-
-    # markup.row(InlineKeyboardButton(text='⬇',
-    #                                 callback_data=edit_quantity_cd.new(increase_or_decrease='decrease',
-    #                                                                    item_id=item.item_id,
-    #                                                                    quantity=quantity)),
-    #            InlineKeyboardButton(text='⬆',
-    #                                 callback_data=edit_quantity_cd.new(increase_or_decrease='increase',
-    #                                                                    item_id=item.item_id,
-    #                                                                    quantity=quantity)))
+                                        item_id=item_id,
+                                        item_category_code=item_category_code,
+                                        item_subcategory_code=item_subcategory_code)))
 
     markup.row(InlineKeyboardButton(text='⬇',
-                                    callback_data=edit_quantity_cd.new(increase_or_decrease='decrease',
-                                                                       item_id=item.item_id,
-                                                                       quantity=quantity)),
+                                    callback_data=make_edit_quantity_cd('decrease', item_id, quantity,
+                                                                        item_total_quantity, item_category_code,
+                                                                        item_subcategory_code, in_basket)),
                InlineKeyboardButton(text=f'Купить {quantity} шт.\n'
-                                         f'Доступно {item.item_total_quantity} шт.',
-                                    callback_data=buy_item.new(item_id=item.item_id,
+                                         f'Доступно {item_total_quantity} шт.',
+                                    callback_data=buy_item.new(item_id=item_id,
                                                                quantity=quantity)),
                InlineKeyboardButton(text='⬆',
-                                    callback_data=edit_quantity_cd.new(increase_or_decrease='increase',
-                                                                       item_id=item.item_id,
-                                                                       quantity=quantity)))
+                                    callback_data=make_edit_quantity_cd('increase', item_id, quantity,
+                                                                        item_total_quantity, item_category_code,
+                                                                        item_subcategory_code, in_basket)))
 
     markup.row(InlineKeyboardButton(text=f'Добавить в 🧺 {quantity} шт.',
-                                    callback_data=add_to_basket_cd.new(telegram_id=call.from_user.id,
-                                                                       item_id=item.item_id,
+                                    callback_data=add_to_basket_cd.new(telegram_id=telegram_id,
+                                                                       item_id=item_id,
                                                                        quantity=quantity)))
 
-    await check_on_basket_button(call, markup)
+    if in_basket:
+        markup.row(basket_button())
 
     markup.row(InlineKeyboardButton(text='Отправить ссылку на магазин',
                                     switch_inline_query=''))
 
     markup.row(InlineKeyboardButton(text='Назад',
                                     callback_data=make_callback_data(level=CURRENT_LEVEL-1,
-                                                                     item_category_code=item.item_category_code,
-                                                                     item_subcategory_code=item.item_subcategory_code)))
+                                                                     item_category_code=item_category_code,
+                                                                     item_subcategory_code=item_subcategory_code)))
     return markup
 
 
-async def check_on_basket_button(obj: typing.Union[CallbackQuery, Message], markup: InlineKeyboardMarkup):
+def basket_button() -> InlineKeyboardButton:
+    return InlineKeyboardButton(text=f'Перейти в 🧺', callback_data=basket_cd.new(action='show_basket', item_id=0))
+
+
+async def has_basket(obj: typing.Union[CallbackQuery, Message]) -> bool:
     db = get_db(obj)
-    telegram_id = obj.from_user.id
-    if await db.select_items_from_basket(telegram_id):
-        button = InlineKeyboardButton(text=f'Перейти в 🧺',
-                                      callback_data=basket_cd.new(action='show_basket', item_id=0))
-        markup.row(button)
+    return await db.count_items_in_basket(obj.from_user.id) > 0
+
+
+async def check_on_basket_button(obj: typing.Union[CallbackQuery, Message], markup: InlineKeyboardMarkup):
+    if await has_basket(obj):
+        markup.row(basket_button())
 
 
 def back_button_keyboard_for_more_photos(item_id: int) -> InlineKeyboardMarkup:
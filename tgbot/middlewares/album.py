@@ -1,33 +1,84 @@
 import asyncio
-from typing import Union
+import logging
+import time
+from dataclasses import dataclass
+from typing import Union, Optional
 
 from aiogram import types
 from aiogram.dispatcher.handler import CancelHandler, current_handler
 from aiogram.dispatcher.middlewares import BaseMiddleware
 
+from tgbot.middlewares.album_collectors import AlbumCollector, MemoryAlbumCollector, ALBUM_IS_DONE
 
-def album_latency(latency: Union[int, float]):
+logger = logging.getLogger(__name__)
+
+
+def album_latency(latency: Union[int, float], max_wait: Optional[Union[int, float]] = None):
 
     def decorator(func):
         setattr(func, 'album_latency', latency)
+        if max_wait:
+            setattr(func, 'album_max_wait', max_wait)
         return func
 
     return decorator
 
 
+@dataclass
+class AlbumMetrics:
+    """How long the albums were gathered and how many of them were split"""
+    albums_total: int = 0
+    messages_total: int = 0
+    # альбомы, собранные по истечении max_wait, а не после паузы между сообщениями
+    capped_total: int = 0
+    # сообщения, пришедшие после того, как альбом уже был обработан
+    split_total: int = 0
+    latency_total: float = 0.0
+    latency_max: float = 0.0
+
+    @property
+    def latency_avg(self) -> float:
+        return self.latency_total / self.albums_total if self.albums_total else 0.0
+
+    def on_album(self, size: int, latency: float, capped: bool):
+        self.albums_total += 1
+        self.messages_total += size
+        self.capped_total += capped
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+
+    def on_split(self):
+        self.split_total += 1
+
+
 class AlbumMiddleware(BaseMiddleware):
     """This middleware is for capturing media groups."""
 
-    album_data: dict = {}
-
-    def __init__(self, latency: Union[int, float] = 0.01):
+    def __init__(self, collector: Optional[AlbumCollector] = None, latency: Union[int, float] = 0.01,
+                 max_wait: Union[int, float] = 10):
         """
-        You can provide custom latency to make sure
-        albums are handled properly in highload.
+        The album is complete when no new message has come for latency seconds, but not later than max_wait seconds
+        after its first message. Both can be set for a handler with the album_latency decorator.
         """
+        self.collector = collector or MemoryAlbumCollector()
         self.latency = latency
+        self.max_wait = max_wait
+        self.metrics = AlbumMetrics()
         super().__init__()
 
+    async def wait_for_album(self, media_group_id: str, latency: float, max_wait: float) -> bool:
+        """Returns True if the album has been waited for max_wait seconds"""
+        deadline = time.monotonic() + max_wait
+        while True:
+            idle_time = await self.collector.get_idle_time(media_group_id)
+            if idle_time is None or idle_time >= latency:
+                return False
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return True
+            # каждое новое сообщение отодвигает завершение альбома
+            await asyncio.sleep(min(latency - idle_time, remaining))
+
     async def on_process_message(self, message: types.Message, data: dict):
         if not message.media_group_id:
             return
@@ -35,17 +86,21 @@ class AlbumMiddleware(BaseMiddleware):
         if not handler:
             return
         latency = getattr(handler, 'album_latency', self.latency)
-        try:
-            self.album_data[message.media_group_id].append(message)
-            raise CancelHandler()  # Tell aiogram to cancel handler for this group element
-        except KeyError:
-            self.album_data[message.media_group_id] = [message]
-            await asyncio.sleep(latency)
+        max_wait = getattr(handler, 'album_max_wait', self.max_wait)
 
-            message.conf["is_last"] = True
-            data["album"] = self.album_data[message.media_group_id]
+        position = await self.collector.add(message.media_group_id, message)
+        if position == ALBUM_IS_DONE:
+            self.metrics.on_split()
+            logger.warning('Message %s has come after its album %s was handled',
+                           message.message_id, message.media_group_id)
+            data["album"] = [message]
+            return
+        if position > 1:
+            raise CancelHandler()  # Tell aiogram to cancel handler for this group element
 
-    async def on_post_process_message(self, message: types.Message, result: dict, data: dict):
-        """Clean up after handling our album."""
-        if message.media_group_id and message.conf.get("is_last"):
-            del self.album_data[message.media_group_id]
\ No newline at end of file
+        started_at = time.monotonic()
+        capped = await self.wait_for_album(message.media_group_id, latency, max_wait)
+        album = await self.collector.complete(message.media_group_id)
+        self.metrics.on_album(len(album), time.monotonic() - started_at, capped)
+        # сообщения могли прийти в разные процессы не по порядку
+        data["album"] = sorted(album, key=lambda album_message: album_message.message_id) or [message]
@@ -0,0 +1,121 @@
+import abc
+import json
+import time
+import typing
+
+from aiogram import types
+from aioredis import Redis
+
+from tgbot.misc.cache import TTLCache
+
+# add() возвращает это значение, если альбом уже обработан и сообщение пришло слишком поздно
+ALBUM_IS_DONE = -1
+
+# KEYS: сообщения альбома, время последнего сообщения, отметка об обработке альбома;
+# ARGV: сообщение, время жизни альбома в мс. Возвращает номер сообщения в альбоме или -1
+ADD_MEMBER_SCRIPT = """
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    return -1
+end
+local length = redis.call('RPUSH', KEYS[1], ARGV[1])
+local now = redis.call('TIME')
+redis.call('SET', KEYS[2], now[1] .. string.format('%03d', math.floor(tonumber(now[2]) / 1000)), 'PX', ARGV[2])
+redis.call('PEXPIRE', KEYS[1], ARGV[2])
+return length
+"""
+
+# KEYS[1] - время последнего сообщения. Возвращает, сколько мс прошло с него, или -1
+IDLE_TIME_SCRIPT = """
+local last = redis.call('GET', KEYS[1])
+if not last then
+    return -1
+end
+local now = redis.call('TIME')
+return tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000) - tonumber(last)
+"""
+
+# KEYS - те же, что у ADD_MEMBER_SCRIPT; ARGV[1] - сколько мс помнить, что альбом обработан. Возвращает сообщения
+COMPLETE_SCRIPT = """
+local members = redis.call('LRANGE', KEYS[1], 0, -1)
+redis.call('DEL', KEYS[1], KEYS[2])
+redis.call('SET', KEYS[3], 1, 'PX', ARGV[1])
+return members
+"""
+
+
+class AlbumCollector(abc.ABC):
+    """
+    Where the messages of media groups are gathered until the album is complete.
+    The album is taken once by complete(), the messages coming after it are reported by add() as ALBUM_IS_DONE.
+    """
+
+    async def add(self, media_group_id: str, message: types.Message) -> int:
+        """Returns the number of the message in the album or ALBUM_IS_DONE"""
+        raise NotImplementedError
+
+    async def get_idle_time(self, media_group_id: str) -> typing.Optional[float]:
+        """Seconds since the last message of the album, None if the album is unknown"""
+        raise NotImplementedError
+
+    async def complete(self, media_group_id: str) -> typing.List[types.Message]:
+        raise NotImplementedError
+
+
+class MemoryAlbumCollector(AlbumCollector):
+    """Albums in the memory of the process, for the single bot process"""
+
+    def __init__(self, done_ttl: float = 60.0):
+        self._albums: typing.Dict[str, typing.List[types.Message]] = {}
+        self._last_added_at: typing.Dict[str, float] = {}
+        self._done = TTLCache(maxsize=10000, ttl=done_ttl)
+
+    async def add(self, media_group_id: str, message: types.Message) -> int:
+        if media_group_id in self._done:
+            return ALBUM_IS_DONE
+        album = self._albums.setdefault(media_group_id, [])
+        album.append(message)
+        self._last_added_at[media_group_id] = time.monotonic()
+        return len(album)
+
+    async def get_idle_time(self, media_group_id: str) -> typing.Optional[float]:
+        last_added_at = self._last_added_at.get(media_group_id)
+        return time.monotonic() - last_added_at if last_added_at is not None else None
+
+    async def complete(self, media_group_id: str) -> typing.List[types.Message]:
+        self._done.set(media_group_id, True)
+        self._last_added_at.pop(media_group_id, None)
+        return self._albums.pop(media_group_id, [])
+
+
+class RedisAlbumCollector(AlbumCollector):
+    """
+    Albums in Redis shared by all the bot processes: the messages of one album may come to different processes.
+    Time is taken from the Redis server, so the clocks of the processes do not matter.
+    """
+
+    def __init__(self, redis: Redis, album_ttl: float = 60.0, done_ttl: float = 60.0):
+        self.redis = redis
+        self.album_ttl = album_ttl
+        self.done_ttl = done_ttl
+        self._add_member_script = redis.register_script(ADD_MEMBER_SCRIPT)
+        self._idle_time_script = redis.register_script(IDLE_TIME_SCRIPT)
+        self._complete_script = redis.register_script(COMPLETE_SCRIPT)
+
+    @staticmethod
+    def get_keys(media_group_id: str) -> typing.List[str]:
+        # ключи одного альбома попадают в один слот Redis Cluster
+        return [f'album:{{{media_group_id}}}:members',
+                f'album:{{{media_group_id}}}:last_added_at',
+                f'album:{{{media_group_id}}}:done']
+
+    async def add(self, media_group_id: str, message: types.Message) -> int:
+        return await self._add_member_script(keys=self.get_keys(media_group_id),
+                                             args=[message.as_json(), int(self.album_ttl * 1000)])
+
+    async def get_idle_time(self, media_group_id: str) -> typing.Optional[float]:
+        idle_time = await self._idle_time_script(keys=self.get_keys(media_group_id)[1:2])
+        return idle_time / 1000 if idle_time >= 0 else None
+
+    async def complete(self, media_group_id: str) -> typing.List[types.Message]:
+        members = await self._complete_script(keys=self.get_keys(media_group_id), args=[int(self.done_ttl * 1000)])
+        return [types.Message.to_object(json.loads(member)) for member in members]
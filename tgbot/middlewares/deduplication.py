@@ -0,0 +1,36 @@
+import logging
+
+from aiogram import types
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aioredis import Redis
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDeduplicationMiddleware(BaseMiddleware):
+    """
+    Skips the updates that have already been taken by another bot process,
+    e.g. when Telegram repeats the webhook request after a timeout.
+    An update is released if its handler fails, so that Telegram can deliver it again.
+    """
+
+    def __init__(self, redis: Redis, ttl: int = 60 * 60, key_prefix: str = 'update'):
+        self.redis = redis
+        self.ttl = ttl
+        self.prefix = key_prefix
+        super().__init__()
+
+    def get_key(self, update: types.Update) -> str:
+        return f'{self.prefix}:{update.update_id}'
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        if not await self.redis.set(self.get_key(update), 1, nx=True, ex=self.ttl):
+            logger.info('Update %s has already been taken by another worker', update.update_id)
+            raise CancelHandler()
+
+    async def on_post_process_error(self, update: types.Update, exception: BaseException, results: list,
+                                    data: dict):
+        # исключение не обработано, вебхук ответит ошибкой и Telegram пришлет обновление снова
+        if not results:
+            await self.redis.delete(self.get_key(update))
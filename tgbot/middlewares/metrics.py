@@ -0,0 +1,47 @@
+from aiogram import types
+from aiogram.dispatcher.handler import current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+from tgbot.misc.metrics import BotMetrics, current_update_timings
+
+
+def get_update_type(update: types.Update) -> str:
+    for field_name, value in update.values.items():
+        if field_name != 'update_id' and value is not None:
+            return field_name
+    return 'unknown'
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """
+    Measures every update from receiving to the end of processing and attributes it to the handler.
+    It is set up after the middlewares that cancel updates, so the throttled updates are counted as "unhandled".
+    """
+
+    def __init__(self, metrics: BotMetrics):
+        self.metrics = metrics
+        super().__init__()
+
+    async def trigger(self, action, args):
+        # process_message, process_callback_query и т.д. вызываются перед обработчиком, прошедшим фильтры
+        if action.startswith('process_') and action != 'process_update':
+            handler = current_handler.get()
+            timings = current_update_timings.get()
+            if handler and timings:
+                timings.handler = handler.__name__
+        return await super().trigger(action, args)
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        current_update_timings.set(self.metrics.on_update_started(get_update_type(update)))
+
+    async def on_post_process_update(self, update: types.Update, results: list, data: dict):
+        timings = current_update_timings.get()
+        if timings:
+            self.metrics.on_update_finished(timings)
+
+    async def on_post_process_error(self, update: types.Update, exception: BaseException, results: list,
+                                    data: dict):
+        # время обновления запишет post_process_update, он вызывается и после исключения
+        timings = current_update_timings.get()
+        if timings:
+            self.metrics.on_update_failed(timings, exception)
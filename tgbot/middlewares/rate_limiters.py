@@ -0,0 +1,107 @@
+import abc
+import time
+import typing
+from dataclasses import dataclass
+
+from aioredis import Redis
+
+from tgbot.misc.cache import TTLCache
+
+# KEYS[1] - корзина токенов; ARGV: токенов в секунду, емкость корзины, время жизни корзины в мс.
+# Возвращает {1 или 0 - разрешен ли запрос, сколько запросов подряд отклонено, через сколько секунд будет токен}
+TOKEN_BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at', 'exceeded')
+local tokens = tonumber(bucket[1]) or capacity
+local updated_at = tonumber(bucket[2]) or now
+local exceeded = tonumber(bucket[3]) or 0
+tokens = math.min(capacity, tokens + math.max(now - updated_at, 0) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    exceeded = 0
+    allowed = 1
+else
+    exceeded = exceeded + 1
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', string.format('%.6f', now), 'exceeded', exceeded)
+redis.call('PEXPIRE', KEYS[1], ARGV[3])
+return {allowed, exceeded, tostring(retry_after)}
+"""
+
+
+@dataclass
+class ThrottleResult:
+    allowed: bool
+    # сколько запросов подряд отклонено, 0 для разрешенного
+    exceeded_count: int
+    # через сколько секунд будет разрешен следующий запрос
+    retry_after: float
+
+
+class RateLimiter(abc.ABC):
+    """
+    Token bucket for every key: a request takes a token, tokens come back at `rate` per second
+    up to `capacity` in the bucket.
+    """
+
+    async def hit(self, key: str, rate: float, capacity: int = 1) -> ThrottleResult:
+        raise NotImplementedError
+
+    async def get_exceeded_count(self, key: str) -> int:
+        """How many requests have been rejected since the last allowed one"""
+        raise NotImplementedError
+
+    @staticmethod
+    def get_bucket_ttl(rate: float, capacity: int) -> float:
+        # за это время корзина наполняется заново, хранить ее дольше незачем
+        return capacity / rate + 1
+
+
+class MemoryRateLimiter(RateLimiter):
+    """Buckets in the memory of the process, for MemoryStorage"""
+
+    def __init__(self, maxsize: int = 100000):
+        self._buckets = TTLCache(maxsize=maxsize, ttl=60 * 60)
+
+    async def hit(self, key: str, rate: float, capacity: int = 1) -> ThrottleResult:
+        now = time.monotonic()
+        tokens, updated_at, exceeded = self._buckets.get(key, (capacity, now, 0))
+        tokens = min(capacity, tokens + (now - updated_at) * rate)
+        if tokens >= 1:
+            result = ThrottleResult(True, 0, 0.0)
+            tokens -= 1
+        else:
+            result = ThrottleResult(False, exceeded + 1, (1 - tokens) / rate)
+        self._buckets.set(key, (tokens, now, result.exceeded_count))
+        return result
+
+    async def get_exceeded_count(self, key: str) -> int:
+        return self._buckets.get(key, (0, 0, 0))[2]
+
+
+class RedisRateLimiter(RateLimiter):
+    """Buckets in Redis shared by all the bot processes, one script call per request"""
+
+    def __init__(self, redis: Redis, key_prefix: str = 'throttling'):
+        self.redis = redis
+        self.prefix = key_prefix
+        self._token_bucket_script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def get_key(self, key: str) -> str:
+        return f'{self.prefix}:{key}'
+
+    async def hit(self, key: str, rate: float, capacity: int = 1) -> ThrottleResult:
+        ttl_ms = int(self.get_bucket_ttl(rate, capacity) * 1000)
+        allowed, exceeded, retry_after = await self._token_bucket_script(keys=[self.get_key(key)],
+                                                                         args=[rate, capacity, ttl_ms])
+        return ThrottleResult(bool(allowed), int(exceeded), float(retry_after))
+
+    async def get_exceeded_count(self, key: str) -> int:
+        exceeded = await self.redis.hget(self.get_key(key), 'exceeded')
+        return int(exceeded) if exceeded else 0
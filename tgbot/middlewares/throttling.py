@@ -1,20 +1,24 @@
 import asyncio
-from typing import Union
+import logging
+from typing import Union, Optional, Set
 
-from aiogram import Dispatcher
 from aiogram.dispatcher import DEFAULT_RATE_LIMIT
 from aiogram.dispatcher.handler import current_handler, CancelHandler
 from aiogram.dispatcher.middlewares import BaseMiddleware
 from aiogram.types import CallbackQuery, Message
-from aiogram.utils.exceptions import Throttled
 
+from tgbot.middlewares.rate_limiters import RateLimiter, MemoryRateLimiter, ThrottleResult
 
-def rate_limit(limit: int, key=None):
+logger = logging.getLogger(__name__)
+
+
+def rate_limit(limit: float, key=None, burst: int = None):
     """
     Decorator for configuring rate limit and key in different functions.
 
-    :param limit:
+    :param limit: seconds between the requests
     :param key:
+    :param burst: how many requests may be made in a row before the limit works
     :return:
     """
 
@@ -22,6 +26,8 @@ def rate_limit(limit: int, key=None):
         setattr(func, 'throttling_rate_limit', limit)
         if key:
             setattr(func, 'throttling_key', key)
+        if burst:
+            setattr(func, 'throttling_burst', burst)
         return func
 
     return decorator
@@ -29,14 +35,17 @@ def rate_limit(limit: int, key=None):
 
 class ThrottlingMiddleware(BaseMiddleware):
 
-    def __init__(self, limit=DEFAULT_RATE_LIMIT, key_prefix='antiflood_'):
+    def __init__(self, limiter: Optional[RateLimiter] = None, limit=DEFAULT_RATE_LIMIT, burst: int = 1,
+                 key_prefix='antiflood_'):
+        self.limiter = limiter or MemoryRateLimiter()
         self.limit = limit
+        self.burst = burst
         self.prefix = key_prefix
+        self._notices: Set[asyncio.Task] = set()
         super(ThrottlingMiddleware, self).__init__()
 
     async def throttle(self, target: Union[Message, CallbackQuery]):
         handler = current_handler.get()
-        dp = Dispatcher.get_current()
 
         if not handler:
             return
@@ -47,30 +56,50 @@ class ThrottlingMiddleware(BaseMiddleware):
             return
 
         limit = getattr(handler, 'throttling_rate_limit', self.limit)
+        if limit <= 0:
+            return
+        burst = getattr(handler, 'throttling_burst', self.burst)
         key = getattr(handler, 'throttling_key', f"{self.prefix}_{handler.__name__}")
+        msg = target.message if isinstance(target, CallbackQuery) else target
+        # у callback от сообщения, отправленного в инлайн-режиме, нет message и чата
+        key = f'{key}:{msg.chat.id}:{target.from_user.id}' if msg else f'{key}:{target.from_user.id}'
 
-        try:
-            await dp.throttle(key, rate=limit)
-        except Throttled as t:
-            await self.target_throttled(target, t, dp, key)
+        result = await self.limiter.hit(key, rate=1 / limit, capacity=burst)
+        if not result.allowed:
+            await self.target_throttled(target, result, key)
             raise CancelHandler()
 
-    @staticmethod
-    async def target_throttled(target: Union[Message, CallbackQuery],
-                               throttled: Throttled, dispatcher: Dispatcher, key: str):
+    async def target_throttled(self, target: Union[Message, CallbackQuery], throttled: ThrottleResult, key: str):
         msg = target.message if isinstance(target, CallbackQuery) else target
-        delta = throttled.rate - throttled.delta
-        if throttled.exceeded_count == 2:
-            await msg.reply('Слишком часто! Пожалуйста, не так быстро')
+        if not msg:
+            # ответить некуда, кроме всплывающего уведомления; "снова отвечаю" не отправляется
+            if throttled.exceeded_count <= 2:
+                await target.answer('Слишком часто! Пожалуйста, не так быстро')
             return
+        if throttled.exceeded_count == 1:
+            await msg.reply('Слишком часто! Пожалуйста, не так быстро')
+        elif throttled.exceeded_count == 2:
+            await msg.reply(f'Всё. Больше не отвечу, пока не пройдет {round(throttled.retry_after, 1)} сек')
         elif throttled.exceeded_count == 3:
-            await msg.reply(f'Всё. Больше не отвечу, пока не пройдет {round(delta, 1)} сек')
-            return
-        await asyncio.sleep(delta)
+            # токен появится в назначенное время, сколько бы запросов ни пришло до него,
+            # поэтому одного уведомления на все следующие отказы достаточно
+            self.schedule_answering_again(msg, key, throttled.retry_after)
+
+    def schedule_answering_again(self, msg: Message, key: str, delay: float):
+        def send_notice():
+            task = asyncio.create_task(self.answer_again(msg, key))
+            self._notices.add(task)
+            task.add_done_callback(self._notices.discard)
 
-        thr = await dispatcher.check_key(key)
-        if thr.exceeded_count == throttled.exceeded_count:
-            await msg.reply("Всё, теперь снова отвечаю")
+        asyncio.get_running_loop().call_later(delay, send_notice)
+
+    async def answer_again(self, msg: Message, key: str):
+        try:
+            # если после отказа был разрешенный запрос, пользователь уже получил ответ
+            if await self.limiter.get_exceeded_count(key):
+                await msg.reply("Всё, теперь снова отвечаю")
+        except Exception:
+            logger.exception('Throttling notice has not been sent')
 
     async def on_process_message(self, message: Message, data: dict):
         await self.throttle(message)
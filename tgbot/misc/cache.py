@@ -0,0 +1,42 @@
+import time
+import typing
+from collections import OrderedDict
+
+
+class TTLCache:
+    """LRU cache of limited size whose entries expire ttl seconds after they were set."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: 'OrderedDict[typing.Hashable, typing.Tuple[float, typing.Any]]' = OrderedDict()
+
+    def get(self, key: typing.Hashable, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: typing.Hashable, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: typing.Hashable, default=None):
+        entry = self._data.pop(key, None)
+        return entry[1] if entry else default
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        return self.get(key, self) is not self
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,25 @@
+import typing
+
+# имя, под которым регистрируется Database бота
+DB_JOB_CONTEXT = 'db'
+
+_job_context: typing.Dict[str, typing.Any] = {}
+
+
+def register_job_context(name: str, obj: typing.Any):
+    """
+    Jobs of the Redis job store are pickled, so they can't get the bot objects (the database pool etc.) directly.
+    Such jobs get the name of the object in kwargs and take the object with get_job_context().
+    """
+    _job_context[name] = obj
+
+
+def unregister_job_context(name: str):
+    _job_context.pop(name, None)
+
+
+def get_job_context(name: str) -> typing.Any:
+    try:
+        return _job_context[name]
+    except KeyError:
+        raise LookupError(f'Job context "{name}" is not registered') from None
@@ -0,0 +1,131 @@
+import time
+import typing
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from aiogram import Bot
+from aiohttp import web
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+
+if typing.TYPE_CHECKING:
+    from tgbot.db_api.postgres_db import Database
+
+
+@dataclass
+class UpdateTimings:
+    started_at: float
+    update_type: str
+    handler: str = 'unhandled'
+    sql_time: float = 0.0
+    api_time: float = 0.0
+    finished: bool = False
+
+
+# время обновления, которое сейчас обрабатывается; задачи, созданные из обработчика, получают тот же объект
+current_update_timings: ContextVar[typing.Optional[UpdateTimings]] = ContextVar('current_update_timings',
+                                                                                default=None)
+
+
+class BotMetrics:
+    """Prometheus metrics of the updates processing, SQL queries and Bot API requests"""
+
+    def __init__(self, registry: typing.Optional[CollectorRegistry] = None):
+        self.registry = registry or CollectorRegistry()
+        self.updates_total = Counter('bot_updates_total', 'Updates received', ['update_type'],
+                                     registry=self.registry)
+        self.updates_in_flight = Gauge('bot_updates_in_flight', 'Updates being processed', registry=self.registry)
+        self.update_errors_total = Counter('bot_update_errors_total', 'Exceptions raised while processing updates',
+                                           ['handler', 'exception'], registry=self.registry)
+        self.handler_duration = Histogram('bot_handler_duration_seconds', 'Time of processing an update',
+                                          ['handler'], registry=self.registry)
+        self.handler_sql_duration = Histogram('bot_handler_sql_seconds', 'SQL time of processing an update',
+                                              ['handler'], registry=self.registry)
+        self.handler_api_duration = Histogram('bot_handler_api_seconds', 'Bot API time of processing an update',
+                                              ['handler'], registry=self.registry)
+        self.sql_query_duration = Histogram('bot_sql_query_duration_seconds',
+                                            'Time of SQL queries including waiting for a connection', ['query'],
+                                            registry=self.registry)
+        self.api_request_duration = Histogram('bot_api_request_duration_seconds', 'Time of Bot API requests',
+                                              ['method'], registry=self.registry)
+
+    def on_update_started(self, update_type: str) -> UpdateTimings:
+        self.updates_total.labels(update_type).inc()
+        self.updates_in_flight.inc()
+        return UpdateTimings(time.perf_counter(), update_type)
+
+    def on_update_failed(self, timings: UpdateTimings, exception: BaseException):
+        self.update_errors_total.labels(timings.handler, type(exception).__name__).inc()
+
+    def on_update_finished(self, timings: UpdateTimings):
+        if timings.finished:
+            return
+        timings.finished = True
+        self.updates_in_flight.dec()
+        self.handler_duration.labels(timings.handler).observe(time.perf_counter() - timings.started_at)
+        self.handler_sql_duration.labels(timings.handler).observe(timings.sql_time)
+        self.handler_api_duration.labels(timings.handler).observe(timings.api_time)
+
+    def on_sql_query(self, query_name: str, duration: float):
+        self.sql_query_duration.labels(query_name).observe(duration)
+        timings = current_update_timings.get()
+        if timings:
+            timings.sql_time += duration
+
+    def on_api_request(self, method: str, duration: float):
+        self.api_request_duration.labels(method).observe(duration)
+        timings = current_update_timings.get()
+        if timings:
+            timings.api_time += duration
+
+
+def instrument_database(db: 'Database', metrics: BotMetrics):
+    """Times the named queries by their names and the other SQL as "execute" """
+    fetch_query = db._fetch_query
+    execute = db.execute
+
+    async def timed_fetch_query(method: str, query, *args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return await fetch_query(method, query, *args, **kwargs)
+        finally:
+            metrics.on_sql_query(query.name, time.perf_counter() - started_at)
+
+    async def timed_execute(command, *args, **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return await execute(command, *args, **kwargs)
+        finally:
+            metrics.on_sql_query('execute', time.perf_counter() - started_at)
+
+    db._fetch_query = timed_fetch_query
+    db.execute = timed_execute
+
+
+def instrument_bot(bot: Bot, metrics: BotMetrics):
+    """Times every Bot API request, all the methods of Bot go through Bot.request()"""
+    request = bot.request
+
+    async def timed_request(method: str, data: typing.Optional[dict] = None, files: typing.Optional[dict] = None,
+                            **kwargs):
+        started_at = time.perf_counter()
+        try:
+            return await request(method, data, files, **kwargs)
+        finally:
+            metrics.on_api_request(method, time.perf_counter() - started_at)
+
+    bot.request = timed_request
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    metrics: BotMetrics = request.app['metrics']
+    return web.Response(body=generate_latest(metrics.registry), headers={'Content-Type': CONTENT_TYPE_LATEST})
+
+
+async def start_metrics_server(metrics: BotMetrics, host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app['metrics'] = metrics
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -1,33 +1,46 @@
 import datetime
-import typing
-
-from aiogram.types import CallbackQuery, Message
-
-from tgbot.db_api.postgres_db import delete_all_items_from_basket
-from tgbot.misc.secondary_functions import get_scheduler, get_config
-
-
-def clear_basket_on_schedule(obj: typing.Union[Message, CallbackQuery], added_at: datetime.datetime):
-    config = get_config(obj)
-    dsn = config.db.url
-    scheduler = get_scheduler(obj)
-    func = delete_all_items_from_basket
-    kwargs = dict(dsn=dsn, telegram_id=obj.from_user.id)
-    delete_time = added_at + datetime.timedelta(hours=3) + datetime.timedelta(hours=24)
-    job_id = f'clear_basket_{obj.from_user.id}'
-    scheduler.add_job(func,
-                      kwargs=kwargs,
-                      trigger='date',
-                      run_date=delete_time,
-                      id=job_id,
+import logging
+
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+
+from tgbot.config import Config
+from tgbot.db_api.postgres_db import Database
+from tgbot.misc.job_context import get_job_context, DB_JOB_CONTEXT
+
+logger = logging.getLogger(__name__)
+
+BASKET_SWEEPER_JOB_ID = 'basket_sweeper'
+
+
+async def clear_expired_baskets(ttl: int, db_context: str = DB_JOB_CONTEXT):
+    db: Database = get_job_context(db_context)
+    expired_before = datetime.datetime.utcnow() - datetime.timedelta(seconds=ttl)
+    await db.delete_expired_baskets(expired_before)
+
+
+def schedule_basket_sweeper(scheduler: AsyncIOScheduler, db: Database, config: Config) -> bool:
+    if db.basket_storage.expires_by_itself:
+        # задача могла остаться в хранилище задач, пока корзины хранились в Postgres
+        if scheduler.get_job(BASKET_SWEEPER_JOB_ID):
+            scheduler.remove_job(BASKET_SWEEPER_JOB_ID)
+        return False
+    scheduler.add_job(clear_expired_baskets,
+                      kwargs=dict(ttl=config.db.basket_ttl, db_context=DB_JOB_CONTEXT),
+                      trigger='interval',
+                      seconds=config.db.basket_sweep_interval,
+                      next_run_time=datetime.datetime.now(scheduler.timezone),
+                      id=BASKET_SWEEPER_JOB_ID,
                       replace_existing=True,
-                      misfire_grace_time=None)
+                      coalesce=True,
+                      max_instances=1)
     return True
 
 
-def remove_clear_basket_job(obj: typing.Union[Message, CallbackQuery], user_id: typing.Optional[int] = None):
-    scheduler = get_scheduler(obj)
-    job_id = f'clear_basket_{obj.from_user.id}'
-    if user_id:
-        job_id = f'clear_basket_{user_id}'
-    scheduler.remove_job(job_id=job_id)
+def remove_clear_basket_jobs(scheduler: AsyncIOScheduler) -> int:
+    """Removes the per-user jobs "clear_basket_{telegram_id}" left from the time before the sweeper"""
+    jobs = [job for job in scheduler.get_jobs() if job.id.startswith('clear_basket_')]
+    for job in jobs:
+        job.remove()
+    if jobs:
+        logger.info('%s old clear_basket jobs have been removed', len(jobs))
+    return len(jobs)
@@ -117,6 +117,23 @@ class ItemPatterns:
     ITEM_PHOTO_URL = re.compile('^https?://\S+\.(?:jpg|jpeg)$')
 
 
+@dataclass
+class SoldItem:
+    item_id: int
+    item_name: str
+    item_price: int
+    quantity: int
+    item_total_quantity: int
+    out_of_stock: bool
+
+
+def get_sold_item_data(sold_item: Record) -> SoldItem:
+    sold_item_data = dict(sold_item)
+    return SoldItem(sold_item_data.get('item_id'), sold_item_data.get('item_name'), sold_item_data.get('item_price'),
+                    sold_item_data.get('quantity'), sold_item_data.get('item_total_quantity'),
+                    sold_item_data.get('out_of_stock'))
+
+
 @dataclass
 class ItemInBasket:
     full_name: str
@@ -194,26 +211,9 @@ async def reboot_admins_menu(state: FSMContext):
     await AdminActions.add_or_change.set()
 
 
-async def load_basket_payload(items_from_basket) -> typing.Optional[str]:
-    if items_from_basket:
-        payload = str()
-        for item_from_basket in items_from_basket:
-            item_in_basket: ItemInBasket = get_item_in_basket_data(item_from_basket)
-            payload += f'{item_in_basket.item_id}:{item_in_basket.quantity}:'
-        payload += 'b'
-        return payload
-    return
-
-
-def check_payload(payload: typing.Optional[str]) -> bool:
-    if not payload:
-        return True
-
-    else:
-        return True if sys.getsizeof(payload) <= 118 else False
-
+# ограничения корзины: payload счета не должен превышать 118 байт
+BASKET_MAX_LINES = 9
+BASKET_PAYLOAD_MAX_SIZE = 118
+# payload состоит только из цифр, ':' и 'b', поэтому его размер - это длина плюс размер пустой строки
+BASKET_PAYLOAD_MAX_LENGTH = BASKET_PAYLOAD_MAX_SIZE - sys.getsizeof('')
 
-def check_price_list(items_from_basket: typing.Optional[list]) -> bool:
-    if not items_from_basket:
-        return True
-    return True if len(items_from_basket) <= 9 else False
@@ -17,7 +17,8 @@ async def set_bot_commands(dp: Dispatcher):
             BotCommand('help', 'Помощь по командам и функционалу'),
             BotCommand('admins_menu', 'Показать меню администраторов'),
             BotCommand('exit', 'ONLY FOR ADMINS Выйти из всех состояний'),
-            BotCommand('get_photo_id', 'Получить ID фото')
+            BotCommand('get_photo_id', 'Получить ID фото'),
+            BotCommand('db_stats', 'ONLY FOR ADMINS Статистика пула соединений с базой данных')
         ], scope=BotCommandScopeChat(chat_id=telegram_id))
 
     # для личных чатов с ботом
@@ -1,7 +1,18 @@
+import asyncio
 import datetime
 import random
+import statistics
+import time
+import typing
 
+from aioredis import Redis
+
+from tgbot.db_api.basket.redis_storage import RedisBasketStorage
 from tgbot.db_api.postgres_db import Database
+from tgbot.misc.secondary_functions import BASKET_MAX_LINES, BASKET_PAYLOAD_MAX_LENGTH
+
+# пользователи для нагрузочных тестов корзины, чтобы не пересекаться с настоящими telegram_id
+LOAD_TEST_TELEGRAM_ID = 10 ** 12
 
 
 async def fill_database(db: Database, id_start: int, id_finish: int):
@@ -53,6 +64,194 @@ async def del_from_database(db: Database, id_start: int, id_finish: int):
     print(datetime.datetime.now(), 'Удалено')
 
 
+async def fill_basket(db: Database, rows_count: int, items_per_user: int = 5):
+    """Fills the basket table with load test users up to rows_count rows"""
+    current_rows_count = await db.execute('SELECT COUNT(*) FROM basket WHERE telegram_id>$1', LOAD_TEST_TELEGRAM_ID,
+                                          fetchval=True)
+    if current_rows_count >= rows_count:
+        return
+    first_user = LOAD_TEST_TELEGRAM_ID + 1 + current_rows_count // items_per_user
+    last_user = LOAD_TEST_TELEGRAM_ID + rows_count // items_per_user
+    print(datetime.datetime.now(), f'Заполнение корзины до {rows_count} строк')
+    await db.execute("""INSERT INTO users SELECT telegram_id, NULL, 'load test', NULL, now(), NULL
+    FROM generate_series($1::bigint, $2::bigint) AS telegram_id ON CONFLICT DO NOTHING""",
+                     first_user, last_user, execute=True)
+    await db.execute("""INSERT INTO basket SELECT telegram_id, item_id, 1, now()
+    FROM generate_series($1::bigint, $2::bigint) AS telegram_id
+    CROSS JOIN (SELECT item_id FROM items ORDER BY item_id LIMIT $3) AS items
+    ON CONFLICT DO NOTHING""", first_user, last_user, items_per_user, execute=True)
+    await db.execute('ANALYZE basket', execute=True)
+    print(datetime.datetime.now(), 'Заполнено')
+
+
+async def clear_load_test_basket(db: Database):
+    await db.execute('DELETE FROM basket WHERE telegram_id>=$1', LOAD_TEST_TELEGRAM_ID, execute=True)
+    await db.execute('DELETE FROM users WHERE telegram_id>=$1', LOAD_TEST_TELEGRAM_ID, execute=True)
+    db.on_basket_changed()
+
+
+async def measure_add_to_basket(db: Database, item_id: int, repeats: int = 100) -> typing.Dict[str, float]:
+    """
+    Measures Database.add_item_to_basket() for a new basket line and for a line which is already in the basket.
+    It is the only way the bot writes to the basket, and it reads the written line back with RETURNING.
+    Returns the medians and the 95th percentiles in milliseconds.
+    """
+    telegram_id = LOAD_TEST_TELEGRAM_ID
+    await db.execute("""INSERT INTO users VALUES ($1, NULL, 'load test', NULL, now(), NULL)
+    ON CONFLICT DO NOTHING""", telegram_id, execute=True)
+    insert_timings = []
+    update_timings = []
+    for _ in range(repeats):
+        await db.delete_all_items_from_basket(telegram_id)
+        for timings in (insert_timings, update_timings):
+            started_at = time.perf_counter()
+            await db.add_item_to_basket(telegram_id, item_id, 1, datetime.datetime.utcnow(),
+                                        BASKET_MAX_LINES, BASKET_PAYLOAD_MAX_LENGTH)
+            timings.append((time.perf_counter() - started_at) * 1000)
+    await db.delete_all_items_from_basket(telegram_id)
+    return {'insert_median': statistics.median(insert_timings),
+            'insert_p95': statistics.quantiles(insert_timings, n=20)[-1],
+            'update_median': statistics.median(update_timings),
+            'update_p95': statistics.quantiles(update_timings, n=20)[-1]}
+
+
+async def basket_load_test(db: Database, item_id: int,
+                           rows_counts: typing.Sequence[int] = (0, 10_000, 100_000, 1_000_000, 3_000_000)):
+    """
+    Checks that adding to the basket does not slow down as the basket table grows:
+    the latency should stay about the same for every size of the table.
+    The item must have at least 2 pieces in stock.
+    """
+    try:
+        for rows_count in rows_counts:
+            await fill_basket(db, rows_count)
+            total_rows_count = await db.count_items_from_table('basket')
+            result = await measure_add_to_basket(db, item_id)
+            print(datetime.datetime.now(), f'Строк в корзине: {total_rows_count}. Добавление новой строки: '
+                                           f'{result["insert_median"]:.2f} мс (p95 {result["insert_p95"]:.2f} мс), '
+                                           f'увеличение количества: {result["update_median"]:.2f} мс '
+                                           f'(p95 {result["update_p95"]:.2f} мс)')
+    finally:
+        await clear_load_test_basket(db)
+
+
+async def parallel_payments_test(db: Database, item_id: int, stock: int = 10, payments: int = 50,
+                                 quantity: int = 1) -> bool:
+    """
+    Fires payments at one item in parallel through Database.create_order(), as the payment handler does.
+    Checks that the stock does not go negative, that exactly as many payments as the stock allows have taken
+    the goods and that a payment repeated with the same telegram_payment_charge_id takes nothing.
+    """
+    telegram_id = LOAD_TEST_TELEGRAM_ID
+    await db.execute("""INSERT INTO users VALUES ($1, NULL, 'load test', NULL, now(), NULL)
+    ON CONFLICT DO NOTHING""", telegram_id, execute=True)
+    item = await db.get_item_from_items(item_id)
+    initial_stock = item.get('item_total_quantity')
+    await db.update_item_from_items(item_id, 'item_total_quantity', stock)
+    charge_ids = [f'load_test_{time.time_ns()}_{i}' for i in range(payments)]
+
+    def create_order(charge_id: str):
+        return db.create_order([(item_id, quantity)], telegram_id, datetime.datetime.utcnow(), False,
+                               item.get('item_price') * quantity, 'RUB', None, None, None, None, None,
+                               charge_id, charge_id)
+
+    try:
+        print(datetime.datetime.now(), f'{payments} одновременных оплат по {quantity} шт., на складе {stock} шт.')
+        results = await asyncio.gather(*[create_order(charge_id) for charge_id in charge_ids])
+        successful_payments = sum(1 for sold_items in results if not sold_items[0].get('out_of_stock'))
+        final_stock = (await db.get_item_from_items(item_id)).get('item_total_quantity')
+        expected_payments = min(payments, stock // quantity)
+        ok = final_stock == stock - successful_payments * quantity and successful_payments == expected_payments \
+            and final_stock >= 0
+        print(datetime.datetime.now(), f'Списано оплат: {successful_payments} (ожидалось {expected_payments}), '
+                                       f'на складе осталось {final_stock} шт. {"OK" if ok else "ОШИБКА"}')
+
+        repeated = await create_order(charge_ids[0])
+        stock_after_repeat = (await db.get_item_from_items(item_id)).get('item_total_quantity')
+        orders_count = await db.execute('SELECT COUNT(*) FROM orders WHERE telegram_id=$1', telegram_id,
+                                        fetchval=True)
+        repeat_ok = stock_after_repeat == final_stock and orders_count == payments \
+            and repeated[0].get('order_id') == results[0][0].get('order_id')
+        print(datetime.datetime.now(), f'Повторная оплата: заказов {orders_count}, на складе {stock_after_repeat} шт. '
+                                       f'{"OK" if repeat_ok else "ОШИБКА"}')
+        return ok and repeat_ok
+    finally:
+        await db.execute('DELETE FROM orders WHERE telegram_id=$1', telegram_id, execute=True)
+        await db.update_item_from_items(item_id, 'item_total_quantity', initial_stock)
+
+
+async def redis_basket_storage_test(db: Database, redis: Redis, item_id: int, ttl: int = 60) -> bool:
+    """
+    Checks RedisBasketStorage: adding, changing the quantity, the stock and basket limits, the TTL of the basket
+    and the reconciling at checkout. The stock of the item is changed during the test.
+    redis must run Lua scripts: a local Redis server, or fakeredis installed with lupa.
+    The expiry is checked without waiting: the basket is expired with PEXPIREAT in the past.
+    """
+    storage = RedisBasketStorage(db, redis, ttl)
+    telegram_id = LOAD_TEST_TELEGRAM_ID
+    key = storage.get_key(telegram_id)
+    item = await db.get_item_from_items(item_id)
+    initial_stock = item.get('item_total_quantity')
+    await db.update_item_from_items(item_id, 'item_total_quantity', 2)
+    await redis.delete(key)
+    checks = []
+
+    def check(name: str, ok: bool):
+        checks.append(ok)
+        print(datetime.datetime.now(), f'{name}: {"OK" if ok else "ОШИБКА"}')
+
+    try:
+        added_at = datetime.datetime.utcnow()
+        result = await storage.add_item(telegram_id, item_id, 1, added_at, BASKET_MAX_LINES,
+                                        BASKET_PAYLOAD_MAX_LENGTH)
+        check('Добавление', result['quantity'] == 1 and result['quantity_in_basket'] == 0
+              and not result['basket_is_full'] and await storage.count_items(telegram_id) == 1)
+        pttl = await redis.pttl(key)
+        check('Время жизни корзины', 0 < pttl <= ttl * 1000)
+
+        await redis.pexpire(key, 1000)
+        result = await storage.add_item(telegram_id, item_id, 1, added_at, BASKET_MAX_LINES,
+                                        BASKET_PAYLOAD_MAX_LENGTH)
+        basket = await storage.select_items(telegram_id)
+        check('Изменение количества', result['quantity'] == 2 and result['quantity_in_basket'] == 1
+              and len(basket) == 1 and basket[0]['quantity'] == 2)
+        check('Продление времени жизни', await redis.pttl(key) > 1000)
+
+        result = await storage.add_item(telegram_id, item_id, 1, added_at, BASKET_MAX_LINES,
+                                        BASKET_PAYLOAD_MAX_LENGTH)
+        check('Остаток на складе', result['quantity'] is None and result['quantity_in_basket'] == 2
+              and not result['basket_is_full'])
+
+        result = await storage.add_item(telegram_id, item_id, 1, added_at, BASKET_MAX_LINES, 1)
+        check('Заполненная корзина', result['quantity'] is None and result['basket_is_full'])
+
+        await db.update_item_from_items(item_id, 'item_total_quantity', 1)
+        basket = await storage.reconcile(telegram_id, datetime.datetime.utcnow())
+        lines = await storage.select_items(telegram_id)
+        check('Оформление: уменьшение количества', len(basket) == 1 and basket[0]['updated']
+              and basket[0]['quantity'] == 1 and lines[0]['quantity'] == 1)
+
+        await db.update_item_from_items(item_id, 'item_total_quantity', 0)
+        basket = await storage.reconcile(telegram_id, datetime.datetime.utcnow())
+        check('Оформление: товар закончился', len(basket) == 1 and basket[0]['deleted']
+              and await storage.count_items(telegram_id) == 0)
+
+        await db.update_item_from_items(item_id, 'item_total_quantity', 2)
+        await storage.add_item(telegram_id, item_id, 1, added_at, BASKET_MAX_LINES, BASKET_PAYLOAD_MAX_LENGTH)
+        check('Удаление', await storage.delete_item(telegram_id, item_id)
+              and not await storage.delete_item(telegram_id, item_id))
+
+        await storage.add_item(telegram_id, item_id, 1, added_at, BASKET_MAX_LINES, BASKET_PAYLOAD_MAX_LENGTH)
+        # время в прошлом удаляет ключ сразу, как если бы истек TTL
+        await redis.pexpireat(key, 1)
+        check('Истечение корзины', await storage.count_items(telegram_id) == 0
+              and not await storage.select_items(telegram_id))
+        return all(checks)
+    finally:
+        await redis.delete(key)
+        await db.update_item_from_items(item_id, 'item_total_quantity', initial_stock)
+
+
 def create_uniq_name() -> str:
     letters = 'abcdefghijklmnopqrstuvwxyz'
     list_letters = list(letters)
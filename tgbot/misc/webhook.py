@@ -0,0 +1,45 @@
+import asyncio
+import logging
+import signal
+
+from aiogram import Dispatcher
+from aiogram.dispatcher.webhook import get_new_configured_app
+from aiohttp import web
+
+from tgbot.config import WebhookConfig
+from tgbot.misc.allowed_updates import get_handled_updates_list
+
+logger = logging.getLogger(__name__)
+
+
+def set_stop_signals(stop_event: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(stop_signal, stop_event.set)
+        except NotImplementedError:
+            # на Windows обработчики сигналов в цикле событий не поддерживаются, остается KeyboardInterrupt
+            pass
+
+
+async def run_webhook(dp: Dispatcher, webhook: WebhookConfig, set_webhook: bool = True):
+    """
+    Receives updates with aiohttp server until SIGINT or SIGTERM.
+    The rest of the shutdown is done by the caller, the same way as after polling.
+    With several bot processes only the leader sets the webhook.
+    """
+    app = get_new_configured_app(dispatcher=dp, path=webhook.route_path)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, webhook.webapp_host, webhook.webapp_port, reuse_port=webhook.reuse_port or None)
+    stop_event = asyncio.Event()
+    set_stop_signals(stop_event)
+    try:
+        await site.start()
+        logger.info('Webhook server is listening on %s:%s', webhook.webapp_host, webhook.webapp_port)
+        if set_webhook:
+            await dp.bot.set_webhook(webhook.url, allowed_updates=get_handled_updates_list(dp))
+        await stop_event.wait()
+        logger.info('Stopping webhook server')
+    finally:
+        await runner.cleanup()
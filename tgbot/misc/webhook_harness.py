@@ -0,0 +1,129 @@
+"""
+Load test of the webhook mode without Telegram.
+
+The bot is started with USE_WEBHOOK=true and BOT_API_SERVER pointing at the fake Bot API of this module,
+then synthetic updates are POSTed to the webhook:
+
+    python -m tgbot.misc.webhook_harness --url http://localhost:8080/webhook --updates 1000 --concurrency 50 \
+        --fake-api-port 8081
+"""
+import argparse
+import asyncio
+import itertools
+import statistics
+import time
+import typing
+
+from aiohttp import web, ClientSession
+
+# методы Bot API, которые возвращают True, а не объект
+BOOL_METHODS_PREFIXES = ('answer', 'delete', 'set', 'edit')
+
+
+def make_user(user_id: int) -> dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': 'Load', 'last_name': 'Test', 'username': f'load_{user_id}'}
+
+
+def make_message_update(update_id: int, chat_id: int, text: str) -> dict:
+    return {'update_id': update_id,
+            'message': {'message_id': update_id, 'date': int(time.time()), 'text': text,
+                        'from': make_user(chat_id), 'chat': {'id': chat_id, 'type': 'private'}}}
+
+
+def make_callback_query_update(update_id: int, chat_id: int, data: str) -> dict:
+    message = {'message_id': update_id, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'},
+               'photo': [{'file_id': 'photo', 'file_unique_id': 'photo', 'width': 600, 'height': 600}]}
+    return {'update_id': update_id,
+            'callback_query': {'id': str(update_id), 'from': make_user(chat_id), 'message': message,
+                               'chat_instance': str(chat_id), 'data': data}}
+
+
+async def fake_bot_api_method(request: web.Request) -> web.Response:
+    method = request.match_info['method']
+    data = await request.post()
+    chat_id = int(data.get('chat_id', 1))
+    message = {'message_id': 1, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'}}
+    if method == 'getMe':
+        result = {'id': 1, 'is_bot': True, 'first_name': 'Bot', 'username': 'bot'}
+    elif method == 'sendMediaGroup':
+        result = [message]
+    elif method.startswith(BOOL_METHODS_PREFIXES):
+        result = True
+    else:
+        result = message
+    return web.json_response({'ok': True, 'result': result})
+
+
+def create_fake_bot_api() -> web.Application:
+    """Bot API which answers every request successfully, so the bot's handlers do not wait for Telegram"""
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', fake_bot_api_method)
+    return app
+
+
+async def post_updates(url: str, updates: typing.List[dict], concurrency: int) -> typing.Dict[str, float]:
+    timings = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def post_update(session: ClientSession, update: dict):
+        nonlocal errors
+        async with semaphore:
+            started_at = time.perf_counter()
+            async with session.post(url, json=update) as response:
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+            timings.append(time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*[post_update(session, update) for update in updates])
+    duration = time.perf_counter() - started_at
+    return {'updates': len(updates),
+            'errors': errors,
+            'duration': duration,
+            'updates_per_second': len(updates) / duration,
+            'latency_median': statistics.median(timings),
+            'latency_p95': statistics.quantiles(timings, n=20)[-1]}
+
+
+def make_updates(count: int, first_chat_id: int, users: int, text: str, callback_data: typing.Optional[str]) -> \
+        typing.List[dict]:
+    chat_ids = itertools.cycle(range(first_chat_id, first_chat_id + users))
+    if callback_data:
+        return [make_callback_query_update(update_id, next(chat_ids), callback_data)
+                for update_id in range(1, count + 1)]
+    return [make_message_update(update_id, next(chat_ids), text) for update_id in range(1, count + 1)]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description='Posts synthetic updates to the webhook of the bot')
+    parser.add_argument('--url', required=True, help='webhook url including the secret')
+    parser.add_argument('--updates', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--users', type=int, default=100, help='number of different senders')
+    parser.add_argument('--first-chat-id', type=int, default=10 ** 12)
+    parser.add_argument('--text', default='/help')
+    parser.add_argument('--callback-data', default=None, help='send callback queries instead of messages')
+    parser.add_argument('--fake-api-port', type=int, default=None, help='also run the fake Bot API on this port')
+    args = parser.parse_args()
+
+    runner = None
+    if args.fake_api_port:
+        runner = web.AppRunner(create_fake_bot_api())
+        await runner.setup()
+        await web.TCPSite(runner, '0.0.0.0', args.fake_api_port).start()
+    try:
+        updates = make_updates(args.updates, args.first_chat_id, args.users, args.text, args.callback_data)
+        result = await post_updates(args.url, updates, args.concurrency)
+        print(f'Обновлений: {result["updates"]}, ошибок: {result["errors"]}, за {result["duration"]:.2f} с '
+              f'({result["updates_per_second"]:.1f} в секунду). Время ответа: медиана '
+              f'{result["latency_median"] * 1000:.1f} мс, p95 {result["latency_p95"] * 1000:.1f} мс')
+    finally:
+        if runner:
+            await runner.cleanup()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import os
+import socket
+import typing
+
+from aioredis import Redis
+from aioredis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+LEADER_KEY = 'bot:leader'
+
+# KEYS[1] - блокировка; ARGV: идентификатор процесса, время жизни в мс. Продлевает только свою блокировку
+RENEW_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# KEYS[1] - блокировка; ARGV[1] - идентификатор процесса. Удаляет только свою блокировку
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def get_worker_id() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+class LeaderLock:
+    """
+    Only one of the bot processes holds the lock. The leader does the startup-only work (bot commands, admin
+    notification, webhook setting) and runs the scheduler. The lock expires ttl seconds after the last renewal,
+    so if the leader dies, another process takes its place.
+    """
+
+    def __init__(self, redis: Redis, worker_id: str, key: str = LEADER_KEY, ttl: float = 30.0):
+        self.redis = redis
+        self.worker_id = worker_id
+        self.key = key
+        self.ttl = ttl
+        self.is_leader = False
+        self._renew_script = redis.register_script(RENEW_SCRIPT)
+        self._release_script = redis.register_script(RELEASE_SCRIPT)
+
+    async def acquire(self) -> bool:
+        """Takes the lock or renews it if it's already ours"""
+        ttl_ms = int(self.ttl * 1000)
+        if self.is_leader:
+            self.is_leader = bool(await self._renew_script(keys=[self.key], args=[self.worker_id, ttl_ms]))
+        if not self.is_leader:
+            self.is_leader = bool(await self.redis.set(self.key, self.worker_id, nx=True, px=ttl_ms))
+        return self.is_leader
+
+    async def release(self):
+        if self.is_leader:
+            await self._release_script(keys=[self.key], args=[self.worker_id])
+            self.is_leader = False
+
+    async def keep(self, on_elected: typing.Callable[[], typing.Any], on_dismissed: typing.Callable[[], typing.Any]):
+        """Renews the lock or tries to take it until cancelled, calls back when the leadership changes"""
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            was_leader = self.is_leader
+            try:
+                await self.acquire()
+            except (RedisError, OSError):
+                logger.exception('Leader lock "%s" could not be renewed', self.key)
+                # пока Redis недоступен, блокировка может истечь и достаться другому процессу
+                self.is_leader = False
+            if self.is_leader and not was_leader:
+                logger.info('Worker %s has become the leader', self.worker_id)
+                on_elected()
+            elif was_leader and not self.is_leader:
+                logger.warning('Worker %s is not the leader anymore', self.worker_id)
+                on_dismissed()